@@ -8,7 +8,7 @@ Linux specific functions.
 """
 
 from __future__ import with_statement
-import sys,os,struct,socket,time
+import sys,os,struct,socket,time,errno,mmap
 from select import select
 from fcntl import ioctl
 import scapy.utils
@@ -51,14 +51,23 @@ PACKET_DROP_MEMBERSHIP = 2
 PACKET_RECV_OUTPUT     = 3
 PACKET_RX_RING         = 5
 PACKET_STATISTICS      = 6
+PACKET_VERSION         = 10
 PACKET_MR_MULTICAST    = 0
 PACKET_MR_PROMISC      = 1
 PACKET_MR_ALLMULTI     = 2
 
+# From linux/if_packet.h
+TPACKET_V3        = 2
+TP_STATUS_KERNEL  = 0
+TP_STATUS_USER    = 1
+TPACKET3_HDRLEN   = 48 # TPACKET_ALIGN(sizeof(struct tpacket3_hdr))
+
 # From bits/socket.h
 SOL_PACKET = 263
+MSG_WAITFORONE = 0x10000
 # From asm/socket.h
 SO_ATTACH_FILTER = 26
+SO_TIMESTAMP = 29 # also SCM_TIMESTAMP
 SOL_SOCKET = 1
 
 # From net/route.h
@@ -307,11 +316,224 @@ def _flush_fd(fd):
 
 
 
+#######################
+## sendmmsg/recvmmsg ##
+#######################
+
+# The message headers are packed and unpacked with struct, a whole batch at
+# once, as setting and getting ctypes fields one by one costs more than the
+# system calls saved
+
+_SOCKADDR_LL = "HHiHBB8s" # struct format of struct sockaddr_ll
+
+try:
+    import ctypes
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _sendmmsg = _libc.sendmmsg
+    _recvmmsg = _libc.recvmmsg
+except (ImportError, OSError, AttributeError): # no ctypes, libc older than 2.14
+    _sendmmsg = _recvmmsg = None
+else:
+    class msghdr(ctypes.Structure):
+        _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint),
+                    ("msg_iov", ctypes.c_void_p), ("msg_iovlen", ctypes.c_size_t),
+                    ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                    ("msg_flags", ctypes.c_int)]
+    class mmsghdr(ctypes.Structure):
+        _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+    # struct formats of struct iovec, struct mmsghdr (with the padding of
+    # struct msghdr) and of a control message holding a struct timeval
+    _IOVEC = "PL"
+    _MMSGHDR = "PIPLPLi%ixI%ix" % (ctypes.sizeof(msghdr)-struct.calcsize("PIPLPLi"),
+                                   ctypes.sizeof(mmsghdr)-ctypes.sizeof(msghdr)-4)
+    _CMSG_TIMEVAL = "Lii%ixll" % (-struct.calcsize("Lii") % struct.calcsize("L"))
+    def _address(s):
+        """DEV: the address of the data of the string s"""
+        return ctypes.cast(s, ctypes.c_void_p).value
+
+def _mmsg_error(sent, nbytes):
+    """DEV: the socket.error of a failed sendmmsg(), telling how many frames
+(.sent) and bytes (.nbytes) were sent before"""
+    err = ctypes.get_errno()
+    e = socket.error(err, os.strerror(err))
+    e.sent,e.nbytes = sent,nbytes
+    return e
+
+def sockaddr_ll(iff, proto):
+    """DEV: the struct sockaddr_ll to send <proto> frames through iff with
+sendmmsg()"""
+    return struct.pack(_SOCKADDR_LL, socket.AF_PACKET, socket.htons(proto),
+                       get_if_index(iff), 0, 0, 0, "")
+
+class MMsgSender:
+    """Buffers for sendmmsg(2) to send up to <count> frames through sock at
+once. The message headers are only rebuilt when the destinations change"""
+    def __init__(self, sock, count):
+        self.sock,self.count = sock,count
+        self.msgsz = struct.calcsize(_MMSGHDR)
+        self.iovsz = struct.calcsize(_IOVEC)
+        self.iovs = ctypes.create_string_buffer(count*self.iovsz)
+        self.msgs = ctypes.create_string_buffer(count*self.msgsz)
+        self.addrs = None # the destinations of the current headers
+        self.set_addrs(None)
+
+    def set_addrs(self, addrs, n=None):
+        """DEV: writes the headers of n frames (all by default) sent to addrs,
+a sockaddr_ll() for all of them, one for each or None if the socket is
+bound"""
+        if n is None:
+            n = self.count
+        iov = ctypes.addressof(self.iovs)
+        hdrs = [0, 0, None, 1, 0, 0, 0, 0]*n
+        hdrs[2::8] = xrange(iov, iov+n*self.iovsz, self.iovsz)
+        if type(addrs) is str:
+            hdrs[0::8] = [_address(addrs)]*n
+            hdrs[1::8] = [len(addrs)]*n
+        elif addrs is not None:
+            hdrs[0::8] = map(_address, addrs)
+            hdrs[1::8] = map(len, addrs)
+        ctypes.memmove(self.msgs, struct.pack(_MMSGHDR*n, *hdrs), n*self.msgsz)
+        self.addrs = addrs
+
+    def send(self, frames, addrs=None):
+        """Sends the strings of <frames> with as few sendmmsg(2) calls as
+possible, and returns the number of bytes sent
+addrs: the sockaddr_ll() of each frame, or None if the socket is bound
+If a frame cannot be sent, the socket.error raised tells how many frames
+(.sent) and bytes (.nbytes) were sent before it"""
+        fd = self.sock.fileno()
+        msgs = ctypes.addressof(self.msgs)
+        sent = nbytes = 0
+        while sent < len(frames):
+            chunk = frames[sent:sent+self.count]
+            n = len(chunk)
+            if addrs is not None:
+                a = addrs[sent:sent+n]
+                if a.count(a[0]) == n:
+                    a = a[0]
+            else:
+                a = None
+            if type(a) is list:
+                self.set_addrs(a, n)
+            elif a != self.addrs:
+                self.set_addrs(a)
+            data = "".join(chunk)
+            lens = map(len, chunk)
+            iovs = [None]*(2*n)
+            iovs[1::2] = lens
+            off = _address(data)
+            for i in xrange(n):
+                iovs[2*i] = off
+                off += lens[i]
+            ctypes.memmove(self.iovs, struct.pack(_IOVEC*n, *iovs), n*self.iovsz)
+            i = 0
+            while i < n:
+                r = _sendmmsg(fd, ctypes.c_void_p(msgs+i*self.msgsz), n-i, 0)
+                if r < 0:
+                    if ctypes.get_errno() == errno.EINTR:
+                        continue
+                    raise _mmsg_error(sent+i, nbytes+sum(lens[:i]))
+                i += r
+            sent += n
+            nbytes += len(data)
+        return nbytes
+
+class MMsgReceiver:
+    """Buffers for recvmmsg(2) to receive up to <count> frames of <size> bytes
+from sock at once, with their kernel timestamps (SO_TIMESTAMP)"""
+    ctrlsz = 64
+    def __init__(self, sock, count, size=MTU):
+        self.sock,self.count,self.size = sock,count,size
+        sock.setsockopt(SOL_SOCKET, SO_TIMESTAMP, 1)
+        self.msgsz = struct.calcsize(_MMSGHDR)
+        self.addrsz = struct.calcsize(_SOCKADDR_LL)
+        self.data = ctypes.create_string_buffer(count*size)
+        self.ctrl = ctypes.create_string_buffer(count*self.ctrlsz)
+        self.ctrlfmt = _CMSG_TIMEVAL+"%ix" % (self.ctrlsz-struct.calcsize(_CMSG_TIMEVAL))
+        self.addrs = ctypes.create_string_buffer(count*self.addrsz)
+        self.iovs = ctypes.create_string_buffer(count*struct.calcsize(_IOVEC))
+        data = ctypes.addressof(self.data)
+        iovs = []
+        for i in xrange(count):
+            iovs += (data+i*size, size)
+        ctypes.memmove(self.iovs, struct.pack(_IOVEC*count, *iovs), len(self.iovs))
+        iov,iovsz = ctypes.addressof(self.iovs),struct.calcsize(_IOVEC)
+        addrs,ctrl = ctypes.addressof(self.addrs),ctypes.addressof(self.ctrl)
+        hdrs = []
+        for i in xrange(count):
+            hdrs += (addrs+i*self.addrsz, self.addrsz, iov+i*iovsz, 1,
+                     ctrl+i*self.ctrlsz, self.ctrlsz, 0, 0)
+        # the kernel overwrites the lengths: they are reset from this copy
+        self.hdrs = struct.pack(_MMSGHDR*count, *hdrs)
+        self.msgs = ctypes.create_string_buffer(len(self.hdrs))
+
+    def recv(self, count=None):
+        """waits for a frame, then returns the (frame, sa_ll, timestamp)
+of up to <count> frames waiting on the socket, sa_ll being what
+recvfrom() would have returned, with the interface index instead of
+its name"""
+        if count is None or count > self.count:
+            count = self.count
+        ctypes.memmove(self.msgs, self.hdrs, count*self.msgsz)
+        while True:
+            r = _recvmmsg(self.sock.fileno(), self.msgs, count, MSG_WAITFORONE, None)
+            if r >= 0:
+                break
+            err = ctypes.get_errno()
+            if err != errno.EINTR:
+                raise socket.error(err, os.strerror(err))
+        hdrs = struct.unpack_from(_MMSGHDR*r, self.msgs)
+        addrs = struct.unpack_from(_SOCKADDR_LL*r, self.addrs)
+        ctrl = struct.unpack_from(self.ctrlfmt*r, self.ctrl)
+        now = time.time() # for frames without a timestamp
+        res = []
+        for i in xrange(r):
+            j,k = 7*i,5*i
+            sa_ll = (addrs[j+2], socket.ntohs(addrs[j+1]), addrs[j+4], addrs[j+3],
+                     addrs[j+6][:addrs[j+5]])
+            ts = now
+            if hdrs[8*i+5] and ctrl[k+1:k+3] == (SOL_SOCKET, SO_TIMESTAMP): # msg_controllen
+                ts = ctrl[k+3]+ctrl[k+4]/1000000.0
+            off = i*self.size
+            res.append((self.data[off:off+min(hdrs[8*i+7], self.size)], sa_ll, ts))
+        return res
+
+def recv_one(sock, x=MTU):
+    """DEV: the recv() method of the PF_PACKET sockets. Once recv_batch() has
+set SO_TIMESTAMP on the socket, SIOCGSTAMP no longer gives the timestamps
+and the frames are received with recvmmsg(2) too"""
+    if sock.mmsg_in is None:
+        pkt, sa_ll = sock.ins.recvfrom(x)
+        return sock.make_packet(pkt, sa_ll)
+    pkts = recv_batch(sock, 1, x)
+    if pkts:
+        return pkts[0]
+
+def recv_batch(sock, count, x=MTU):
+    """DEV: the recv_batch() method of the PF_PACKET sockets, which dissect
+the frames with their make_packet()"""
+    if _recvmmsg is None:
+        return SuperSocket.recv_batch(sock, count, x)
+    if sock.mmsg_in is None or sock.mmsg_in.size != x:
+        sock.mmsg_in = MMsgReceiver(sock.ins, max(count, sock.batch_size), x)
+    pkts = []
+    for pkt, sa_ll, ts in sock.mmsg_in.recv(count):
+        p = sock.make_packet(pkt, sa_ll, ts)
+        if p is not None:
+            pkts.append(p)
+    return pkts
+
+
 
 class L3PacketSocket(SuperSocket):
     desc = "read/write packets at layer 3 using Linux PF_PACKET sockets"
+    batch_size = 64 # packets sent or received at once by the batch loops
+    mmsg_in = mmsg_out = None # see MMsgReceiver, MMsgSender
     def __init__(self, type = ETH_P_ALL, filter=None, promisc=None, iface=None, nofilter=0):
         self.type = type
+        self.ll_headers = {}
+        self.hatypes = {}
+        self.sll = {}
         self.ins = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(type))
         self.ins.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 0)
         if iface:
@@ -350,7 +572,14 @@ class L3PacketSocket(SuperSocket):
                 set_promisc(self.ins, i, 0)
         SuperSocket.close(self)
     def recv(self, x=MTU):
-        pkt, sa_ll = self.ins.recvfrom(x)
+        return recv_one(self, x)
+    def recv_batch(self, count=None, x=MTU):
+        """returns the packets waiting on the socket, up to <count>, after
+having waited for the first one. Uses recvmmsg(2) when available"""
+        return recv_batch(self, count or self.batch_size, x)
+    def make_packet(self, pkt, sa_ll, ts=None):
+        """DEV: dissects a frame received with recvfrom(). ts: its timestamp,
+if it is not that of the last frame received by the socket"""
         if sa_ll[2] == socket.PACKET_OUTGOING:
             return None
         if sa_ll[3] in conf.l2types:
@@ -376,38 +605,125 @@ class L3PacketSocket(SuperSocket):
             pkt = pkt.payload
             
         if pkt is not None:
-            pkt.time = get_last_packet_timestamp(self.ins)
+            if ts is None:
+                ts = get_last_packet_timestamp(self.ins)
+            pkt.time = ts
         return pkt
     
-    def send(self, x):
+    def get_hatype(self, iff):
+        """DEV: the link type (ARPHRD_*) of iff, got by binding self.outs to it
+the first time"""
+        hatype = self.hatypes.get(iff)
+        if hatype is None:
+            self.outs.bind((iff, self.type))
+            hatype = self.hatypes[iff] = self.outs.getsockname()[3]
+        return hatype
+
+    def build_frame(self, x):
+        """DEV: returns the frame of packet x and its (iface, protocol)
+destination"""
         iff,a,gw  = x.route()
         if iff is None:
             iff = conf.iface
         sdto = (iff, self.type)
-        self.outs.bind(sdto)
-        sn = self.outs.getsockname()
-        ll = lambda x:x
         if type(x) in conf.l3types:
             sdto = (iff, conf.l3types[type(x)])
-        if sn[3] in conf.l2types:
-            ll = lambda x:conf.l2types[sn[3]]()/x
+        hatype = self.get_hatype(iff)
+        if hatype in conf.l2types:
+            return str(conf.l2types[hatype]()/x),sdto
+        return str(x),sdto
+
+    def send(self, x):
+        if type(x) is str:
+            return self.send_raw(x)
+        sx,sdto = self.build_frame(x)
         try:
-            sx = str(ll(x))
             x.sent_time = time.time()
-            self.outs.sendto(sx, sdto)
+            return self.outs.sendto(sx, sdto)
         except socket.error,msg:
             x.sent_time = time.time()  # bad approximation
             if conf.auto_fragment and msg[0] == 90:
-                for p in x.fragment():
-                    self.outs.sendto(str(ll(p)), sdto)
+                return sum(self.outs.sendto(self.build_frame(p)[0], sdto) for p in x.fragment())
             else:
                 raise
+
+    def send_batch(self, pkts):
+        """Sends the packets (or already built IP or IPv6 packets) of pkts
+with sendmmsg(2) and returns the number of bytes sent. Packets too big for
+the interface are fragmented as by send(). If a packet cannot be sent, the
+socket.error raised tells how many packets (.sent) were sent before it"""
+        if _sendmmsg is None:
+            return SuperSocket.send_batch(self, pkts)
+        frames = []
+        addrs = []
+        for x in pkts:
+            if type(x) is str:
+                sx,sdto = self.build_raw_frame(x)
+            else:
+                sx,sdto = self.build_frame(x)
+            frames.append(sx)
+            sll = self.sll.get(sdto)
+            if sll is None:
+                sll = self.sll[sdto] = sockaddr_ll(*sdto)
+            addrs.append(sll)
+        t = time.time()
+        for x in pkts:
+            if type(x) is not str:
+                x.sent_time = t
+        i = nbytes = 0
+        while i < len(frames):
+            try:
+                if self.mmsg_out is None:
+                    self.mmsg_out = MMsgSender(self.outs, self.batch_size)
+                return nbytes+self.mmsg_out.send(frames[i:], addrs[i:])
+            except socket.error,msg:
+                nbytes += msg.nbytes
+                i += msg.sent
+                if not (conf.auto_fragment and msg[0] == 90 and type(pkts[i]) is not str):
+                    msg.sent,msg.nbytes = i,nbytes
+                    raise
+                nbytes += self.send(pkts[i])
+                i += 1
+        return nbytes
+
+    def build_raw_frame(self, sx):
+        """DEV: returns the frame of sx, an already built IP or IPv6 packet, and
+its (iface, protocol) destination. The link layer header is built once per
+next hop"""
+        if ord(sx[0]) >> 4 == 6:
+            proto = ETH_P_IPV6
+            iff,a,nh = conf.route6.route(socket.inet_ntop(socket.AF_INET6, sx[24:40]))
+            if nh == "::":
+                nh = socket.inet_ntop(socket.AF_INET6, sx[24:40])
+        else:
+            proto = ETH_P_IP
+            iff,a,nh = conf.route.route(socket.inet_ntoa(sx[16:20]))
+            if nh == "0.0.0.0":
+                nh = socket.inet_ntoa(sx[16:20])
+        if iff is None:
+            iff = conf.iface
+        hdr = self.ll_headers.get((iff, nh))
+        if hdr is None:
+            hatype = self.get_hatype(iff)
+            hdr = ""
+            if hatype in conf.l2types:
+                p = str(conf.l2types[hatype]()/conf.l3types[proto](sx))
+                hdr = p[:len(p)-len(sx)]
+            self.ll_headers[(iff, nh)] = hdr
+        return hdr+sx,(iff, proto)
+
+    def send_raw(self, sx):
+        """Sends sx, an already built IP or IPv6 packet (see Packet.iter_raw()).
+The link layer header is built once per next hop."""
+        return self.outs.sendto(*self.build_raw_frame(sx))
                     
 
 
 
 class L2Socket(SuperSocket):
     desc = "read/write packets at layer 2 using Linux PF_PACKET sockets"
+    batch_size = 64 # packets sent or received at once by the batch loops
+    mmsg_in = mmsg_out = None # see MMsgReceiver, MMsgSender
     def __init__(self, iface = None, type = ETH_P_ALL, filter=None, nofilter=0):
         if iface is None:
             iface = conf.iface
@@ -436,7 +752,14 @@ class L2Socket(SuperSocket):
             warning("Unable to guess type (interface=%s protocol=%#x family=%i). Using %s" % (sa_ll[0],sa_ll[1],sa_ll[3],self.LL.name))
             
     def recv(self, x=MTU):
-        pkt, sa_ll = self.ins.recvfrom(x)
+        return recv_one(self, x)
+    def recv_batch(self, count=None, x=MTU):
+        """returns the packets waiting on the socket, up to <count>, after
+having waited for the first one. Uses recvmmsg(2) when available"""
+        return recv_batch(self, count or self.batch_size, x)
+    def make_packet(self, pkt, sa_ll, ts=None):
+        """DEV: dissects a frame received with recvfrom(). ts: its timestamp,
+if it is not that of the last frame received by the socket"""
         if sa_ll[2] == socket.PACKET_OUTGOING:
             return None
         try:
@@ -447,12 +770,31 @@ class L2Socket(SuperSocket):
             if conf.debug_dissector:
                 raise
             q = conf.raw_layer(pkt)
-        q.time = get_last_packet_timestamp(self.ins)
+        if ts is None:
+            ts = get_last_packet_timestamp(self.ins)
+        q.time = ts
         return q
 
+    def send_batch(self, pkts):
+        """Sends the packets (or strings) of pkts with sendmmsg(2) and returns
+the number of bytes sent. If a packet cannot be sent, the socket.error
+raised tells how many packets (.sent) were sent before it"""
+        if _sendmmsg is None:
+            return SuperSocket.send_batch(self, pkts)
+        frames = map(str, pkts)
+        t = time.time()
+        for x in pkts:
+            if type(x) is not str:
+                x.sent_time = t
+        if self.mmsg_out is None:
+            self.mmsg_out = MMsgSender(self.outs, self.batch_size)
+        return self.mmsg_out.send(frames)
+
 
 class L2ListenSocket(SuperSocket):
     desc = "read packets at layer 2 using Linux PF_PACKET sockets"
+    batch_size = 64 # packets received at once by the batch loops
+    mmsg_in = None # see MMsgReceiver
     def __init__(self, iface = None, type = ETH_P_ALL, promisc=None, filter=None, nofilter=0):
         self.type = type
         self.outs = None
@@ -490,7 +832,14 @@ class L2ListenSocket(SuperSocket):
         SuperSocket.close(self)
 
     def recv(self, x=MTU):
-        pkt, sa_ll = self.ins.recvfrom(x)
+        return recv_one(self, x)
+    def recv_batch(self, count=None, x=MTU):
+        """returns the packets waiting on the socket, up to <count>, after
+having waited for the first one. Uses recvmmsg(2) when available"""
+        return recv_batch(self, count or self.batch_size, x)
+    def make_packet(self, pkt, sa_ll, ts=None):
+        """DEV: dissects a frame received with recvfrom(). ts: its timestamp,
+if it is not that of the last frame received by the socket"""
         if sa_ll[3] in conf.l2types :
             cls = conf.l2types[sa_ll[3]]
         elif sa_ll[1] in conf.l3types:
@@ -507,13 +856,101 @@ class L2ListenSocket(SuperSocket):
             if conf.debug_dissector:
                 raise
             pkt = conf.raw_layer(pkt)
-        pkt.time = get_last_packet_timestamp(self.ins)
+        if ts is None:
+            ts = get_last_packet_timestamp(self.ins)
+        pkt.time = ts
         return pkt
     
     def send(self, x):
         raise Scapy_Exception("Can't send anything with L2ListenSocket")
 
 
+class L2mmapListenSocket(L2ListenSocket):
+    """Reads the frames and their timestamps from a ring buffer shared with
+the kernel (PACKET_MMAP, TPACKET_V3), without a system call per frame.
+The ring is made of <block_nr> blocks of <block_size> bytes, each one
+handed to the socket when it is full or <retire_tov> ms after its first
+frame"""
+    desc = "read packets at layer 2 from a Linux PACKET_MMAP ring buffer"
+    block_size = 1<<20
+    block_nr = 16
+    retire_tov = 10
+    def __init__(self, iface = None, type = ETH_P_ALL, promisc=None, filter=None, nofilter=0):
+        L2ListenSocket.__init__(self, iface=iface, type=type, promisc=promisc,
+                                filter=filter, nofilter=nofilter)
+        self.ring = None
+        try:
+            self.ins.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            frame_size = 2048 # only checked against the block size with TPACKET_V3
+            self.ins.setsockopt(SOL_PACKET, PACKET_RX_RING,
+                                struct.pack("7I", self.block_size, self.block_nr, frame_size,
+                                            self.block_size/frame_size*self.block_nr,
+                                            self.retire_tov, 0, 0))
+            self.ring = mmap.mmap(self.ins.fileno(), self.block_size*self.block_nr,
+                                  mmap.MAP_SHARED, mmap.PROT_READ|mmap.PROT_WRITE)
+        except (socket.error, mmap.error),msg:
+            self.close()
+            raise Scapy_Exception("Unable to set up the PACKET_MMAP ring: %s" % msg)
+        self.block = 0  # the block being read
+        self.left = 0   # the number of frames left in it
+        self.offset = 0 # the offset of the next one in the ring
+        # drop the frames queued before the ring was set up
+        try:
+            while 1:
+                self.ins.recv(MTU, socket.MSG_DONTWAIT)
+        except socket.error:
+            pass
+
+    def close(self):
+        if self.closed:
+            return
+        if self.ring is not None:
+            self.ring.close()
+        L2ListenSocket.close(self)
+
+    def read_frames(self, count):
+        """DEV: returns the (frame, sa_ll, sec, nsec) of up to <count> frames
+of the ring, after having waited for the first one"""
+        res = []
+        ring = self.ring
+        while len(res) < count:
+            if not self.left:
+                block = self.block*self.block_size
+                status,num,first = struct.unpack_from("III", ring, block+8)
+                if not status & TP_STATUS_USER:
+                    if res:
+                        break
+                    select([self.ins],[],[])
+                    continue
+                self.left,self.offset = num,block+first
+            if self.left:
+                off = self.offset
+                next,sec,nsec,snaplen,length,status,mac = struct.unpack_from("IIIIIIH", ring, off)
+                family,proto,ifindex,hatype,pkttype,halen,addr = struct.unpack_from(_SOCKADDR_LL, ring, off+TPACKET3_HDRLEN)
+                res.append((ring[off+mac:off+mac+snaplen],
+                            (ifindex, socket.ntohs(proto), pkttype, hatype, addr[:halen]),
+                            sec, nsec))
+                self.offset += next
+                self.left -= 1
+            if not self.left: # give the block back to the kernel
+                block = self.block*self.block_size
+                ring[block+8:block+12] = struct.pack("I", TP_STATUS_KERNEL)
+                self.block = (self.block+1) % self.block_nr
+        return res
+
+    def recv(self, x=MTU):
+        return self.recv_batch(1, x)[0]
+    def recv_batch(self, count=None, x=MTU):
+        """returns the packets of the ring, up to <count>, after having waited
+for the first one. The frames are kept whole, up to the block size, whatever x"""
+        pkts = []
+        for frame, sa_ll, sec, nsec in self.read_frames(count or self.batch_size):
+            p = self.make_packet(frame, sa_ll, sec+0.000000001*nsec)
+            p.__dict__["time_ns"] = sec*1000000000+nsec
+            pkts.append(p)
+        return pkts
+
+
 conf.L3socket = L3PacketSocket
 conf.L2socket = L2Socket
 conf.L2listen = L2ListenSocket
@@ -148,6 +148,14 @@ class OID(Gen):
 ## Packet abstract and base classes ##
 ######################################
 
+IMMUTABLE_TYPES = (type(None), bool, int, long, float, str, unicode)
+
+def is_immutable(x):
+    """Tells whether x can be shared without being copied"""
+    if type(x) is tuple:
+        return all(is_immutable(y) for y in x)
+    return type(x) in IMMUTABLE_TYPES
+
 class Packet_metaclass(type):
     def __new__(cls, name, bases, dct):
         if "fields_desc" in dct: # perform resolution of references to other packets
@@ -178,6 +186,18 @@ class Packet_metaclass(type):
             dct["fields_desc"] = final_fld
 
         newcls = super(Packet_metaclass, cls).__new__(cls, name, bases, dct)
+        from fields import compile_fields_plan
+        newcls.dissect_plan = compile_fields_plan(newcls.fields_desc, "getfield")
+        newcls.build_plan = compile_fields_plan(newcls.fields_desc, "addfield")
+        # per-class metadata shared by the instances (see Packet.init_fields())
+        newcls.default_fields = dict((f.name, f.default) for f in newcls.fields_desc)
+        newcls.fieldtype = dict((f.name, f) for f in newcls.fields_desc)
+        newcls.packetfields = [f for f in newcls.fields_desc if f.holds_packets]
+        newcls.mutable_default_fields = [k for k,v in newcls.default_fields.iteritems()
+                                         if not is_immutable(v)]
+        if "aliastypes" not in dct:
+            newcls.aliastypes = newcls.aliastypes[1:]
+        newcls.aliastypes = [newcls] + newcls.aliastypes
         if hasattr(newcls,"register_variant"):
             newcls.register_variant()
         for f in newcls.fields_desc:                
@@ -305,8 +305,11 @@ sniff_promisc : default mode for sniff()
 filter   : bpf filter added to every sniffing socket to exclude traffic from analysis
 histfile : history file
 padding  : includes padding in desassembled packets
+lazy_dissect : if 1, payloads of dissected packets are only dissected when first accessed
 except_filter : BPF filter for packets to ignore
 debug_match : when 1, store received packet that are not matched into debug.recv
+sndrcv_engine : how sr() and co. send while receiving: "fork" (default) sends from a
+                child process, "threads" from a thread, which avoids a fork per call
 route    : holds the Scapy routing table and provides methods to manipulate it
 warning_threshold : how much time between warnings from the same place
 ASN1_default_codec: Codec used by default for ASN1 objects
@@ -344,8 +347,10 @@ extensions_paths: path or list of paths where extensions are to be looked for
     L2listen = None
     histfile = os.path.join(os.path.expanduser("~"), ".scapy_history")
     padding = 1
+    lazy_dissect = 0
     except_filter = ""
     debug_match = 0
+    sndrcv_engine = "fork"
     wepkey = ""
     route = None # Filed by route.py
     route6 = None # Filed by route6.py
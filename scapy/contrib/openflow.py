@@ -341,21 +341,21 @@ class ActionPacketListField(PacketListField):
         return ofp_action_cls.get(t, Raw)(s)
 
     @staticmethod
-    def _get_action_length(s):
-        return struct.unpack("!H", s[2:4])[0]
+    def _get_action_length(s, off=0):
+        return struct.unpack_from("!H", s, off+2)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain:
-            l = ActionPacketListField._get_action_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = ActionPacketListField._get_action_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = self.m2i(pkt, current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 
 ####################### Queues ######################
@@ -395,23 +395,23 @@ class QueuePropertyPacketListField(PacketListField):
         return ofp_queue_property_cls.get(t, Raw)(s)
 
     @staticmethod
-    def _get_queue_property_length(s):
-        return struct.unpack("!H", s[2:4])[0]
+    def _get_queue_property_length(s, off=0):
+        return struct.unpack_from("!H", s, off+2)[0]
 
     def getfield(self, pkt, s):
         lst = []
         l = 0
         ret = ""
-        remain = s
+        off = 0
 
-        while remain:
-            l = QueuePropertyPacketListField._get_queue_property_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = QueuePropertyPacketListField._get_queue_property_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = self.m2i(pkt, current)
             lst.append(p)
 
-        return remain + ret, lst
+        return s[off:] + ret, lst
 
 class OFPPacketQueue(Packet):
 
@@ -436,23 +436,23 @@ class OFPPacketQueue(Packet):
 class QueuePacketListField(PacketListField):
 
     @staticmethod
-    def _get_queue_length(s):
-        return struct.unpack("!H", s[4:6])[0]
+    def _get_queue_length(s, off=0):
+        return struct.unpack_from("!H", s, off+4)[0]
 
     def getfield(self, pkt, s):
         lst = []
         l = 0
         ret = ""
-        remain = s
+        off = 0
 
-        while remain:
-            l = QueuePacketListField._get_queue_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = QueuePacketListField._get_queue_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = OFPPacketQueue(current)
             lst.append(p)
 
-        return remain + ret, lst
+        return s[off:] + ret, lst
 
 
 #####################################################
@@ -903,21 +903,21 @@ class OFPFlowStats(Packet):
 class FlowStatsPacketListField(PacketListField):
 
     @staticmethod
-    def _get_flow_stats_length(s):
-        return struct.unpack("!H", s[:2])[0]
+    def _get_flow_stats_length(s, off=0):
+        return struct.unpack_from("!H", s, off)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain:
-            l = FlowStatsPacketListField._get_flow_stats_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = FlowStatsPacketListField._get_flow_stats_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = OFPFlowStats(current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 class OFPTStatsReplyFlow(_ofp_header):
     name = "OFPST_STATS_REPLY_FLOW"
@@ -91,21 +91,21 @@ class HelloElemPacketListField(PacketListField):
         return ofp_hello_elem_cls.get(t, Raw)(s)
 
     @staticmethod
-    def _get_hello_elem_length(s):
-        return struct.unpack("!H", s[2:4])[0]
+    def _get_hello_elem_length(s, off=0):
+        return struct.unpack_from("!H", s, off+2)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain:
-            l = HelloElemPacketListField._get_hello_elem_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = HelloElemPacketListField._get_hello_elem_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = self.m2i(pkt, current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 
 ####################### Ports #######################
@@ -578,8 +578,8 @@ class OXMPacketListField(PacketListField):
         return ofp_oxm_cls.get(t, Raw)(s)
 
     @staticmethod
-    def _get_oxm_length(s):
-        return struct.unpack("!B", s[3])[0]
+    def _get_oxm_length(s, off=0):
+        return struct.unpack_from("!B", s, off+3)[0]
 
     def addfield(self, pkt, s, val):
         return s + "".join(map(str,self.i2m(pkt, val)))
@@ -589,15 +589,16 @@ class OXMPacketListField(PacketListField):
         lim = self.length_from(pkt)
         ret = s[lim:]
         remain = s[:lim]
+        off = 0
 
-        while remain and len(remain) > 4:
-            l = OXMPacketListField._get_oxm_length(remain) + 4
+        while len(remain) - off > 4:
+            l = OXMPacketListField._get_oxm_length(remain, off) + 4
             # this could also be done by parsing oxm_fields (fixed lengths)
-            if l <= 4 or len(remain) < l:
+            if l <= 4 or len(remain) - off < l:
             # no incoherent length
                 break
-            current = remain[:l]
-            remain = remain[l:]
+            current = remain[off:off+l]
+            off += l
             p = self.m2i(pkt, current)
             lst.append(p)
 
@@ -608,7 +609,7 @@ class OXMPacketListField(PacketListField):
         ### e.g. if you create OFPMatch with OFBTCPSrc and then change to OFBTCPDst,
         ### index will already be filled with ethertype and nwproto codes,
         ### thus the corresponding fields will not be added to the packet
-        return remain + ret, lst
+        return remain[off:] + ret, lst
 
 class OXMIDPacketListField(PacketListField):
     def m2i(self, pkt, s):
@@ -620,15 +621,16 @@ class OXMIDPacketListField(PacketListField):
         lim = self.length_from(pkt)
         ret = s[lim:]
         remain = s[:lim]
+        off = 0
 
-        while remain and len(remain) >= 4:
+        while len(remain) - off >= 4:
         # all OXM ID are 32-bit long (no experimenter OXM support here)
-            current = remain[:4]
-            remain = remain[4:]
+            current = remain[off:off+4]
+            off += 4
             p = self.m2i(pkt, current)
             lst.append(p)
 
-        return remain + ret, lst
+        return remain[off:] + ret, lst
 
 
 class OFPMatch(Packet):
@@ -981,25 +983,25 @@ class ActionPacketListField(PacketListField):
         return ofp_action_cls.get(t, Raw)(s)
 
     @staticmethod
-    def _get_action_length(s):
-        return struct.unpack("!H", s[2:4])[0]
+    def _get_action_length(s, off=0):
+        return struct.unpack_from("!H", s, off+2)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain and len(remain)>=4:
-            l = ActionPacketListField._get_action_length(remain)
-            if l < 8 or len(remain) < l:
+        while len(s) - off >= 4:
+            l = ActionPacketListField._get_action_length(s, off)
+            if l < 8 or len(s) - off < l:
               # length should be at least 8 (non-zero, 64-bit aligned),
               # and no incoherent length
               break
-            current = remain[:l]
-            remain = remain[l:]
+            current = s[off:off+l]
+            off += l
             p = self.m2i(pkt, current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 
 ##################### Action IDs ####################
@@ -1198,25 +1200,25 @@ class ActionIDPacketListField(PacketListField):
         return ofp_action_id_cls.get(t, Raw)(s)
 
     @staticmethod
-    def _get_action_id_length(s):
-        return struct.unpack("!H", s[2:4])[0]
+    def _get_action_id_length(s, off=0):
+        return struct.unpack_from("!H", s, off+2)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain and len(remain) >= 4:
-            l = ActionIDPacketListField._get_action_id_length(remain)
-            if l < 4 or len(remain) < l:
+        while len(s) - off >= 4:
+            l = ActionIDPacketListField._get_action_id_length(s, off)
+            if l < 4 or len(s) - off < l:
             # length is 4 (may be more for experimenter messages),
             # and no incoherent length
                 break
-            current = remain[:l]
-            remain = remain[l:]
+            current = s[off:off+l]
+            off += l
             p = self.m2i(pkt, current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 
 #################### Instructions ###################
@@ -1301,25 +1303,25 @@ class InstructionPacketListField(PacketListField):
         return ofp_instruction_cls.get(t, Raw)(s)
 
     @staticmethod
-    def _get_instruction_length(s):
-        return struct.unpack("!H", s[2:4])[0]
+    def _get_instruction_length(s, off=0):
+        return struct.unpack_from("!H", s, off+2)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain and len(remain) > 4:
-            l = InstructionPacketListField._get_instruction_length(remain)
-            if l < 8 or len(remain) < l:
+        while len(s) - off > 4:
+            l = InstructionPacketListField._get_instruction_length(s, off)
+            if l < 8 or len(s) - off < l:
             # length should be at least 8 (non-zero, 64-bit aligned),
             # and no incoherent length
                 break
-            current = remain[:l]
-            remain = remain[l:]
+            current = s[off:off+l]
+            off += l
             p = self.m2i(pkt, current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 
 ################## Instruction IDs ##################
@@ -1376,25 +1378,25 @@ class InstructionIDPacketListField(PacketListField):
         return ofp_instruction_cls.get(t, Raw)(s)
 
     @staticmethod
-    def _get_instruction_id_length(s):
-        return struct.unpack("!H", s[2:4])[0]
+    def _get_instruction_id_length(s, off=0):
+        return struct.unpack_from("!H", s, off+2)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain and len(remain) >= 4:
-            l = InstructionIDPacketListField._get_instruction_id_length(remain)
-            if l < 4 or len(remain) < l:
+        while len(s) - off >= 4:
+            l = InstructionIDPacketListField._get_instruction_id_length(s, off)
+            if l < 4 or len(s) - off < l:
             # length is 4 (may be more for experimenter messages),
             # and no incoherent length
                 break
-            current = remain[:l]
-            remain = remain[l:]
+            current = s[off:off+l]
+            off += l
             p = self.m2i(pkt, current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 
 ###################### Buckets ######################
@@ -1422,21 +1424,21 @@ class OFPBucket(Packet):
 class BucketPacketListField(PacketListField):
 
     @staticmethod
-    def _get_bucket_length(s):
-        return struct.unpack("!H", s[:2])[0]
+    def _get_bucket_length(s, off=0):
+        return struct.unpack_from("!H", s, off)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain:
-            l = BucketPacketListField._get_bucket_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = BucketPacketListField._get_bucket_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = OFPBucket(current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 
 ####################### Queues ######################
@@ -1476,21 +1478,21 @@ class QueuePropertyPacketListField(PacketListField):
         return ofp_queue_property_cls.get(t, Raw)(s)
 
     @staticmethod
-    def _get_queue_property_length(s):
-        return struct.unpack("!H", s[2:4])[0]
+    def _get_queue_property_length(s, off=0):
+        return struct.unpack_from("!H", s, off+2)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain:
-            l = QueuePropertyPacketListField._get_queue_property_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = QueuePropertyPacketListField._get_queue_property_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = self.m2i(pkt, current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 class OFPPacketQueue(Packet):
 
@@ -1515,21 +1517,21 @@ class OFPPacketQueue(Packet):
 class QueuePacketListField(PacketListField):
 
     @staticmethod
-    def _get_queue_length(s):
-        return struct.unpack("!H", s[4:6])[0]
+    def _get_queue_length(s, off=0):
+        return struct.unpack_from("!H", s, off+4)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain:
-            l = QueuePacketListField._get_queue_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = QueuePacketListField._get_queue_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = OFPPacketQueue(current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 
 #################### Meter bands ####################
@@ -1574,15 +1576,15 @@ class MeterBandPacketListField(PacketListField):
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain:
-            current = remain[:16]
-            remain = remain[16:]
+        while off < len(s):
+            current = s[off:off+16]
+            off += 16
             p = self.m2i(pkt, current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 
 #####################################################
@@ -2299,21 +2301,21 @@ class OFPFlowStats(Packet):
 class FlowStatsPacketListField(PacketListField):
 
     @staticmethod
-    def _get_flow_stats_length(s):
-        return struct.unpack("!H", s[:2])[0]
+    def _get_flow_stats_length(s, off=0):
+        return struct.unpack_from("!H", s, off)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain:
-            l = FlowStatsPacketListField._get_flow_stats_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = FlowStatsPacketListField._get_flow_stats_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = OFPFlowStats(current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 class OFPMPReplyFlow(_ofp_header):
     name = "OFPMP_REPLY_FLOW"
@@ -2523,21 +2525,21 @@ class OFPGroupStats(Packet):
 class GroupStatsPacketListField(PacketListField):
 
     @staticmethod
-    def _get_group_stats_length(s):
-        return struct.unpack("!H", s[:2])[0]
+    def _get_group_stats_length(s, off=0):
+        return struct.unpack_from("!H", s, off)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain:
-            l = GroupStatsPacketListField._get_group_stats_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = GroupStatsPacketListField._get_group_stats_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = OFPGroupStats(current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 class OFPMPReplyGroup(_ofp_header):
     name = "OFPMP_REPLY_GROUP"
@@ -2583,21 +2585,21 @@ class OFPGroupDesc(Packet):
 class GroupDescPacketListField(PacketListField):
 
     @staticmethod
-    def _get_group_desc_length(s):
-        return struct.unpack("!H", s[:2])[0]
+    def _get_group_desc_length(s, off=0):
+        return struct.unpack_from("!H", s, off)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain:
-            l = GroupsDescPacketListField._get_group_desc_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = GroupsDescPacketListField._get_group_desc_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = OFPGroupDesc(current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 
 class OFPMPReplyGroupDesc(_ofp_header):
@@ -2694,23 +2696,23 @@ class OFPMeterStats(Packet):
 class MeterStatsPacketListField(PacketListField):
 
     @staticmethod
-    def _get_meter_stats_length(s):
-        return struct.unpack("!H", s[4:6])[0]
+    def _get_meter_stats_length(s, off=0):
+        return struct.unpack_from("!H", s, off+4)[0]
 
     def getfield(self, pkt, s):
         lst = []
         l = 0
         ret = ""
-        remain = s
+        off = 0
 
-        while remain:
-            l = MeterStatsPacketListField._get_meter_stats_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = MeterStatsPacketListField._get_meter_stats_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = OFPMeterStats(current)
             lst.append(p)
 
-        return remain + ret, lst
+        return s[off:] + ret, lst
 
 class OFPMPReplyMeter(_ofp_header):
     name = "OFPMP_REPLY_METER"
@@ -2757,21 +2759,21 @@ class OFPMeterConfig(Packet):
 class MeterConfigPacketListField(PacketListField):
 
     @staticmethod
-    def _get_meter_config_length(s):
-        return struct.unpack("!H", s[:2])[0]
+    def _get_meter_config_length(s, off=0):
+        return struct.unpack_from("!H", s, off)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain:
-            l = MeterConfigPacketListField._get_meter_config_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = MeterConfigPacketListField._get_meter_config_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = OFPMeterConfig(current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 class OFPMPReplyMeterConfig(_ofp_header):
     name = "OFPMP_REPLY_METER_CONFIG"
@@ -2997,8 +2999,8 @@ ofp_table_features_prop_cls = {     0: OFPTFPTInstructions,
 class TableFeaturesPropPacketListField(PacketListField):
 
     @staticmethod
-    def _get_table_features_prop_length(s):
-        return struct.unpack("!H", s[2:4])[0]
+    def _get_table_features_prop_length(s, off=0):
+        return struct.unpack_from("!H", s, off+2)[0]
 
     def m2i(self, pkt, s):
         t = struct.unpack("!H", s[:2])[0]
@@ -3006,21 +3008,21 @@ class TableFeaturesPropPacketListField(PacketListField):
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
     
-        while remain and len(remain) >= 4:
-            l = TableFeaturesPropPacketListField._get_table_features_prop_length(remain)
+        while len(s) - off >= 4:
+            l = TableFeaturesPropPacketListField._get_table_features_prop_length(s, off)
             # add padding !
             lpad = l + (8 - l%8)%8
-            if l < 4 or len(remain) < lpad:
+            if l < 4 or len(s) - off < lpad:
             # no zero length nor incoherent length
                 break
-            current = remain[:lpad]
-            remain = remain[lpad:]
+            current = s[off:off+lpad]
+            off += lpad
             p = self.m2i(pkt, current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 class OFPTableFeatures(Packet):
     def post_build(self, p, pay):
@@ -3044,21 +3046,21 @@ class OFPTableFeatures(Packet):
 class TableFeaturesPacketListField(PacketListField):
 
     @staticmethod
-    def _get_table_features_length(s):
-        return struct.unpack("!H", s[:2])[0]
+    def _get_table_features_length(s, off=0):
+        return struct.unpack_from("!H", s, off)[0]
 
     def getfield(self, pkt, s):
         lst = []
-        remain = s
+        off = 0
 
-        while remain:
-            l = TableFeaturesPacketListField._get_table_features_length(remain)
-            current = remain[:l]
-            remain = remain[l:]
+        while off < len(s):
+            l = TableFeaturesPacketListField._get_table_features_length(s, off)
+            current = s[off:off+l]
+            off += l
             p = OFPTableFeatures(current)
             lst.append(p)
 
-        return remain, lst
+        return s[off:], lst
 
 class OFPMPRequestTableFeatures(_ofp_header):
     name = "OFPMP_REQUEST_TABLE_FEATURES"
@@ -569,7 +569,22 @@ class FieldListField(Field):
         ret=""
         if l is not None:
             s,ret = s[:l],s[l:]
-            
+
+        if _is_struct_field(self.field, "getfield"):
+            # unpack the items in place and only cut s once at the end
+            st = struct.Struct(self.field.fmt)
+            m2i = self.field.m2i
+            off = 0
+            end = len(s)-st.size
+            while off <= end:
+                if c is not None:
+                    if c <= 0:
+                        break
+                    c -= 1
+                val.append(m2i(pkt, st.unpack_from(s, off)[0]))
+                off += st.size
+            s = s[off:]
+
         while s:
             if c is not None:
                 if c <= 0:
@@ -1005,4 +1020,93 @@ class IPPrefixField(_IPPrefixFieldBase):
 
 class IP6PrefixField(_IPPrefixFieldBase):
     def __init__(self, name, default, wordbytes= 1, length_from= None):
-        _IPPrefixFieldBase.__init__(self, name, default, wordbytes, 16, lambda a: inet_pton(socket.AF_INET6, a), lambda n: inet_ntop(socket.AF_INET6, n), length_from)
\ No newline at end of file
+        _IPPrefixFieldBase.__init__(self, name, default, wordbytes, 16, lambda a: inet_pton(socket.AF_INET6, a), lambda n: inet_ntop(socket.AF_INET6, n), length_from)
+
+
+################################
+## Dissection and build plans ##
+################################
+
+_BITS_FMT = { 8:"B", 16:"H", 32:"I", 64:"Q" }
+
+def _is_struct_field(f, meth):
+    """True if f is handled by the generic struct code of Field.<meth>()"""
+    return (isinstance(f, Field) and not (f.islist or f.holds_packets)
+            and getattr(f.__class__, meth).im_func is getattr(Field, meth).im_func
+            and f.fmt[0] != "@" and f.sz > 0
+            and struct.calcsize(f.fmt) == f.sz)
+
+def _is_bit_field(f, meth):
+    """True if f is handled by the generic code of BitField.<meth>()"""
+    return (isinstance(f, BitField) and not (f.islist or f.holds_packets)
+            and getattr(f.__class__, meth).im_func is getattr(BitField, meth).im_func)
+
+def _has_conv(f, meth):
+    """True if f overloads the conversion used by <meth> (m2i() or i2m())"""
+    conv = {"getfield":"m2i", "addfield":"i2m"}[meth]
+    return getattr(f.__class__, conv).im_func is not getattr(Field, conv).im_func
+
+def compile_fields_plan(flist, meth):
+    """Compile a fields_desc list into a dissection (meth="getfield") or a
+build (meth="addfield") plan.
+
+Runs of consecutive fixed-width fields sharing the same byte order are merged
+into a single struct.Struct, and runs of bit fields that add up to a whole
+8, 16, 32 or 64 bit word are handled as one integer split with masks. Each
+step of the plan is either:
+  (None, field, track) : call field.<meth>(); track tells whether the value
+                         must be copied into raw_packet_cache_fields
+  (Struct, items, flds): (un)pack the run at once. items holds one
+                         (field, conv, bits) tuple per struct member, where
+                         bits is None or a list of (field, shift, mask, conv)
+                         tuples and conv tells whether field.m2i() (resp.
+                         field.i2m()) is overloaded and must be called. flds
+                         is the list of fields of the run, used to fall back
+                         on field.<meth>()
+"""
+    # Emph() is transparent for dissection and build
+    flist = [ f.fld if isinstance(f, Emph) else f for f in flist ]
+    plan = []
+    run = None   # [byte order, struct formats, items, fields]
+    i = 0
+    n = len(flist)
+    while i < n:
+        f = flist[i]
+        item = None
+        if _is_bit_field(f, meth):
+            j = i
+            size = 0
+            while j < n and _is_bit_field(flist[j], meth):
+                size += flist[j].size
+                j += 1
+            if size in _BITS_FMT:
+                bits = []
+                shift = size
+                for bf in flist[i:j]:
+                    shift -= bf.size
+                    bits.append((bf, shift, (1L << bf.size)-1, _has_conv(bf, meth)))
+                order,fmt,item = "!",_BITS_FMT[size],(None,False,bits)
+                flds = flist[i:j]
+        elif _is_struct_field(f, meth):
+            j = i+1
+            order,fmt = f.fmt[0],f.fmt[1:]
+            if order == ">":
+                order = "!"
+            item = (f, _has_conv(f, meth), None)
+            flds = [f]
+        else:
+            j = i+1
+        if item is None:
+            for f in flist[i:j]:
+                run = None
+                plan.append((None, f, f.islist or f.holds_packets))
+        else:
+            if run is None or run[0] != order:
+                run = [order, [], [], []]
+                plan.append(run)
+            run[1].append(fmt)
+            run[2].append(item)
+            run[3] += flds
+        i = j
+    return [ (struct.Struct(s[0]+"".join(s[1])), s[2], s[3])
+             if type(s) is list else s for s in plan ]
@@ -147,9 +147,12 @@ class DNSRRField(StrField):
             name,p = DNSgetstr(s,p)
             rr,p = self.decodeRR(name, s, p)
             if ret is None:
-                ret = rr
+                ret = last = rr
             else:
-                ret.add_payload(rr)
+                last.add_payload(rr)
+            # keep track of the last layer to chain the RRs in linear time
+            while not isinstance(last.payload, NoPayload):
+                last = last.payload
         if self.passon:
             return (s,p),ret
         else:
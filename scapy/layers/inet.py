@@ -350,6 +350,17 @@ class IP(Packet, IPTools):
             p = p[:10]+chr(ck>>8)+chr(ck&0xff)+p[12:]
         return p+pay
 
+    def raw_checksums(self, s, off, uoff):
+        if self.chksum is not None:
+            return []
+        return [(off+10, [(off, off+((ord(s[off])&0xf)<<2))])]
+
+    def raw_pseudo_header(self, s, off):
+        return [(off+12, off+20)], off+struct.unpack("!H", s[off+2:off+4])[0]
+
+    def raw_route_fields(self):
+        return ["dst"]
+
     def extract_padding(self, s):
         l = self.len - (self.ihl << 2)
         return s[:l],s[l:]
@@ -443,7 +454,6 @@ class TCP(Packet):
                     ShortField("urgptr", 0),
                     TCPOptionsField("options", {}) ]
     def post_build(self, p, pay):
-        p += pay
         dataofs = self.dataofs
         if dataofs is None:
             dataofs = 5+((len(self.get_field("options").i2m(self,self.options))+3)/4)
@@ -453,20 +463,28 @@ class TCP(Packet):
                 if self.underlayer.len is not None:
                     ln = self.underlayer.len-20
                 else:
-                    ln = len(p)
+                    ln = len(p)+len(pay)
                 psdhdr = struct.pack("!4s4sHH",
                                      inet_aton(self.underlayer.src),
                                      inet_aton(self.underlayer.dst),
                                      self.underlayer.proto,
                                      ln)
-                ck=checksum(psdhdr+p)
+                ck = self.payload_checksum(psdhdr+p, pay)
                 p = p[:16]+struct.pack("!H", ck)+p[18:]
             elif conf.ipv6_enabled and isinstance(self.underlayer, scapy.layers.inet6.IPv6) or isinstance(self.underlayer, scapy.layers.inet6._IPv6ExtHdr):
-                ck = scapy.layers.inet6.in6_chksum(socket.IPPROTO_TCP, self.underlayer, p)
+                ck = scapy.layers.inet6.in6_chksum(socket.IPPROTO_TCP, self.underlayer, p+pay)
                 p = p[:16]+struct.pack("!H", ck)+p[18:]
             else:
                 warning("No IP underlayer to compute checksum. Leaving null.")
-        return p
+        return p+pay
+    def raw_checksums(self, s, off, uoff):
+        if self.chksum is not None:
+            return []
+        ph = self.underlayer is not None and self.underlayer.raw_pseudo_header(s, uoff)
+        if not ph:
+            return None
+        ranges,end = ph
+        return [(off+16, [(off, end)]+ranges)]
     def hashret(self):
         if conf.checkIPsrc:
             return struct.pack("H",self.sport ^ self.dport)+self.payload.hashret()
@@ -497,30 +515,37 @@ class UDP(Packet):
                     ShortField("len", None),
                     XShortField("chksum", None), ]
     def post_build(self, p, pay):
-        p += pay
         l = self.len
         if l is None:
-            l = len(p)
+            l = len(p)+len(pay)
             p = p[:4]+struct.pack("!H",l)+p[6:]
         if self.chksum is None:
             if isinstance(self.underlayer, IP):
                 if self.underlayer.len is not None:
                     ln = self.underlayer.len-20
                 else:
-                    ln = len(p)
+                    ln = len(p)+len(pay)
                 psdhdr = struct.pack("!4s4sHH",
                                      inet_aton(self.underlayer.src),
                                      inet_aton(self.underlayer.dst),
                                      self.underlayer.proto,
                                      ln)
-                ck=checksum(psdhdr+p)
+                ck = self.payload_checksum(psdhdr+p, pay)
                 p = p[:6]+struct.pack("!H", ck)+p[8:]
             elif isinstance(self.underlayer, scapy.layers.inet6.IPv6) or isinstance(self.underlayer, scapy.layers.inet6._IPv6ExtHdr):
-                ck = scapy.layers.inet6.in6_chksum(socket.IPPROTO_UDP, self.underlayer, p)
+                ck = scapy.layers.inet6.in6_chksum(socket.IPPROTO_UDP, self.underlayer, p+pay)
                 p = p[:6]+struct.pack("!H", ck)+p[8:]
             else:
                 warning("No IP underlayer to compute checksum. Leaving null.")
-        return p
+        return p+pay
+    def raw_checksums(self, s, off, uoff):
+        if self.chksum is not None:
+            return []
+        ph = self.underlayer is not None and self.underlayer.raw_pseudo_header(s, uoff)
+        if not ph:
+            return None
+        ranges,end = ph
+        return [(off+6, [(off, end)]+ranges)]
     def extract_padding(self, s):
         l = self.len - 8
         return s[:l],s[l:]
@@ -602,11 +627,18 @@ class ICMP(Packet):
                     
                     ]
     def post_build(self, p, pay):
-        p += pay
         if self.chksum is None:
-            ck = checksum(p)
+            ck = self.payload_checksum(p, pay)
             p = p[:2]+chr(ck>>8)+chr(ck&0xff)+p[4:]
-        return p
+        return p+pay
+
+    def raw_checksums(self, s, off, uoff):
+        if self.chksum is not None:
+            return []
+        ph = self.underlayer is not None and self.underlayer.raw_pseudo_header(s, uoff)
+        if not ph:
+            return None
+        return [(off+2, [(off, ph[1])])]
     
     def hashret(self):
         if self.type in [0,8,13,14,15,16,17,18]:
@@ -374,6 +374,15 @@ class IPv6(_IPv6GuessPayload, Packet, IPTools):
         l = self.plen
         return s[:l], s[l:]
 
+    def raw_pseudo_header(self, s, off):
+        return [(off+8, off+40)], off+40+struct.unpack("!H", s[off+4:off+6])[0]
+
+    def raw_checksums(self, s, off, uoff):
+        return [] # post_build() only sets plen
+
+    def raw_route_fields(self):
+        return ["dst"]
+
     def hashret(self):
         if self.nh == 58 and isinstance(self.payload, _ICMPv6):
             if self.payload.type < 128:
@@ -341,6 +341,8 @@ class ARP(Packet):
         if isinstance(dst,Gen):
             dst = iter(dst).next()
         return conf.route.route(dst)
+    def raw_route_fields(self):
+        return ["pdst"]
     def extract_padding(self, s):
         return "",s
     def mysummary(self):
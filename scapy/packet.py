@@ -8,12 +8,13 @@ Packet class. Binding mechanism. fuzz() method.
 """
 
 import time,itertools,os
-import copy
-from fields import StrField,ConditionalField,Emph,PacketListField
+import copy,struct
+from fields import StrField,StrFixedLenField,ConditionalField,Emph,PacketListField
 from config import conf
-from base_classes import BasePacket,Gen,SetGen,Packet_metaclass,NewDefaultValues
+from base_classes import BasePacket,Gen,SetGen,Packet_metaclass,NewDefaultValues,is_immutable
 from volatile import VolatileValue
 from utils import import_hexcap,tex_escape,colgen,get_temp_file
+from utils import checksum,checksum_sum,checksum_fold,checksum_update
 from error import Scapy_Exception,log_runtime
 import subprocess
 
@@ -32,6 +33,36 @@ class RawVal:
         return "<RawVal [%r]>" % self.val
 
 
+def raw_snapshot(fld, val):
+    """DEV: returns what is kept of the value of a field holding a list or
+packets at dissection time, to detect later changes without copying it"""
+    if type(val) is list:
+        for v in val:
+            if isinstance(v, Packet) and v.raw_packet_cache_len() is None:
+                return fld.do_copy(val)
+        return tuple(val)
+    if isinstance(val, Packet):
+        l = val.raw_packet_cache_len()
+        if l is not None:
+            return l
+    elif is_immutable(val):
+        return val
+    return fld.do_copy(val)
+
+def raw_unchanged(val, snapshot):
+    """DEV: tells whether val is still the value raw_snapshot() was given"""
+    if type(snapshot) is tuple and type(val) is list:
+        if len(val) != len(snapshot):
+            return False
+        for v,s in zip(val, snapshot):
+            if v is not s or (isinstance(v, Packet) and v.raw_packet_cache_len() is None):
+                return False
+        return True
+    if type(snapshot) is int and isinstance(val, Packet):
+        return val.raw_packet_cache_len() == snapshot
+    return val == snapshot
+
+
 class Packet(BasePacket):
     __metaclass__ = Packet_metaclass
     name=None
@@ -40,16 +71,24 @@ class Packet(BasePacket):
 
     aliastypes = []
     overload_fields = {}
+    overloaded_fields = {}
+    post_transforms = []
 
     underlayer = None
 
-    sent_time = None
+    sent_time = 0
     payload_guess = []
+    payload_guess_index = None
     initialized = 0
     show_indent=1
     explicit = 0
     raw_packet_cache = None
     raw_packet_cache_fields = None
+    lazy_payload = None
+    shared_fields = 0
+    checksum_memo = None
+    comment = None
+    time_ns = None
 
     @classmethod
     def from_hexcap(cls):
@@ -67,18 +106,17 @@ class Packet(BasePacket):
 
     def __init__(self, _pkt="", post_transform=None, _internal=0, _underlayer=None, **fields):
         self.time  = time.time()
-        self.sent_time = 0
         if self.name is None:
             self.name = self.__class__.__name__
-        self.aliastypes = [ self.__class__ ] + self.aliastypes
-        self.default_fields = {}
-        self.overloaded_fields = {}
         self.fields={}
-        self.fieldtype={}
-        self.packetfields=[]
         self.__dict__["payload"] = NoPayload()
         self.init_fields()
-        self.underlayer = _underlayer
+        if _underlayer is not None:
+            self.underlayer = _underlayer
+        if type(post_transform) is list:
+            self.post_transforms = post_transform
+        elif post_transform is not None:
+            self.post_transforms = [post_transform]
         self.initialized = 1
         self.original = _pkt
         if _pkt:
@@ -87,17 +125,22 @@ class Packet(BasePacket):
                 self.dissection_done(self)
         for f in fields.keys():
             self.fields[f] = self.get_field(f).any2i(self,fields[f])
-        if type(post_transform) is list:
-            self.post_transforms = post_transform
-        elif post_transform is None:
-            self.post_transforms = []
-        else:
-            self.post_transforms = [post_transform]
 
     def init_fields(self):
-        self.do_init_fields(self.fields_desc)
+        """DEV: sets up the default values of the fields. default_fields,
+fieldtype and packetfields are built once per class by Packet_metaclass
+and shared by the instances. Only mutable default values are copied"""
+        if self.mutable_default_fields:
+            self.default_fields = default_fields = self.default_fields.copy()
+            for fname in self.mutable_default_fields:
+                default_fields[fname] = copy.deepcopy(default_fields[fname])
 
     def do_init_fields(self, flist):
+        """DEV: sets up instance specific default_fields, fieldtype and
+packetfields from flist"""
+        self.default_fields = {}
+        self.fieldtype = {}
+        self.packetfields = []
         for f in flist:
             self.default_fields[f.name] = copy.deepcopy(f.default)
             self.fieldtype[f.name] = f
@@ -107,7 +150,10 @@ class Packet(BasePacket):
     def dissection_done(self,pkt):
         """DEV: will be called after a dissection is completed"""
         self.post_dissection(pkt)
-        self.payload.dissection_done(pkt)
+        if self.lazy_payload is not None:
+            self.lazy_payload[3] = pkt
+        else:
+            self.payload.dissection_done(pkt)
         
     def post_dissection(self, pkt):
         """DEV: is called after the dissection of the whole packet"""
@@ -135,31 +181,67 @@ class Packet(BasePacket):
             else:
                 raise TypeError("payload must be either 'Packet' or 'str', not [%s]" % repr(payload))
     def remove_payload(self):
-        self.payload.remove_underlayer(self)
+        if self.lazy_payload is not None:
+            self.__dict__["lazy_payload"] = None
+        else:
+            self.payload.remove_underlayer(self)
         self.__dict__["payload"] = NoPayload()
         self.overloaded_fields = {}
+        # the dissected strings do not match this layer and its underlayers anymore
+        p = self
+        while p is not None and p.original:
+            p.__dict__["original"] = ""
+            p = p.underlayer
     def add_underlayer(self, underlayer):
         self.underlayer = underlayer
     def remove_underlayer(self,other):
         self.underlayer = None
     def copy(self):
-        """Returns a deep copy of the instance."""
+        """Returns a deep copy of the instance. The field values are shared
+with the copy until one of them is changed (copy on write)."""
         clone = self.__class__()
-        clone.fields = self.copy_fields_dict(self.fields)
-        clone.default_fields = self.copy_fields_dict(self.default_fields)
-        clone.overloaded_fields = self.overloaded_fields.copy()
-        clone.overload_fields = self.overload_fields.copy()
-        clone.underlayer = self.underlayer
-        clone.explicit = self.explicit
-        clone.raw_packet_cache = self.raw_packet_cache
-        clone.raw_packet_cache_fields = self.copy_fields_dict(
-            self.raw_packet_cache_fields
-        )
-        clone.post_transforms = self.post_transforms[:]
-        clone.__dict__["payload"] = self.payload.copy()
+        # the attributes are set in __dict__ not to look for fields with
+        # these names through the whole payload chain
+        d = clone.__dict__
+        if self.fields:
+            d["fields"] = self.fields
+            self.__dict__["shared_fields"] = d["shared_fields"] = 1
+        if self.default_fields is not self.__class__.default_fields:
+            d["default_fields"] = self.copy_fields_dict(self.default_fields)
+        if "overloaded_fields" in self.__dict__:
+            d["overloaded_fields"] = self.overloaded_fields
+        if "overload_fields" in self.__dict__:
+            d["overload_fields"] = self.overload_fields.copy()
+        d["underlayer"] = self.underlayer
+        d["explicit"] = self.explicit
+        if self.check_raw_packet_cache():
+            d["raw_packet_cache"] = self.raw_packet_cache
+            # the snapshots hold the values now shared by clone
+            d["raw_packet_cache_fields"] = self.raw_packet_cache_fields
+            # so that an unchanged copy builds to the dissected string too
+            d["original"] = self.original
+        if "post_transforms" in self.__dict__:
+            d["post_transforms"] = self.post_transforms[:]
+        if self.checksum_memo is not None:
+            d["checksum_memo"] = self.checksum_memo
+        if self.comment is not None:
+            d["comment"] = self.comment
+        d["payload"] = self.payload.copy()
         clone.payload.add_underlayer(clone)
         return clone
 
+    def unshare_fields(self):
+        """DEV: gives the instance its own copy of the fields dict (and of the
+mutable values it holds) when it is shared with other instances by copy()"""
+        valid = self.check_raw_packet_cache()
+        self.__dict__["fields"] = self.copy_fields_dict(self.fields)
+        self.__dict__["shared_fields"] = 0
+        if valid and self.raw_packet_cache_fields is not None:
+            self.__dict__["raw_packet_cache_fields"] = dict(
+                (fname, raw_snapshot(self.get_field(fname), self.getfieldval(fname)))
+                for fname in self.raw_packet_cache_fields
+            )
+
     def getfieldval(self, attr):
         if attr in self.fields:
             return self.fields[attr]
@@ -171,7 +253,12 @@ class Packet(BasePacket):
     
     def getfield_and_val(self, attr):
         if attr in self.fields:
-            return self.get_field(attr),self.fields[attr]
+            v = self.fields[attr]
+            if self.shared_fields and not is_immutable(v):
+                # the value may be changed in place by the caller
+                self.unshare_fields()
+                v = self.fields[attr]
+            return self.get_field(attr),v
         if attr in self.overloaded_fields:
             return self.get_field(attr),self.overloaded_fields[attr]
         if attr in self.default_fields:
@@ -179,6 +266,8 @@ class Packet(BasePacket):
         return self.payload.getfield_and_val(attr)
     
     def __getattr__(self, attr):
+        if attr == "payload" and self.lazy_payload is not None:
+            return self.do_dissect_lazy_payload()
         if self.initialized:
             fld,v = self.getfield_and_val(attr)
             if fld is not None:
@@ -193,6 +282,8 @@ class Packet(BasePacket):
                 any2i = lambda x,y: y
             else:
                 any2i = fld.any2i
+            if self.shared_fields:
+                self.unshare_fields()
             self.fields[attr] = any2i(self, val)
             self.explicit = 0
             self.raw_packet_cache = None
@@ -215,6 +306,8 @@ class Packet(BasePacket):
 
     def delfieldval(self, attr):
         if self.fields.has_key(attr):
+            if self.shared_fields:
+                self.unshare_fields()
             del(self.fields[attr])
             self.explicit = 0 # in case a default value must be explicited
             self.raw_packet_cache = None
@@ -304,27 +397,113 @@ class Packet(BasePacket):
     def copy_fields_dict(self, fields):
         if fields is None:
             return None
-        return dict([fname, self.copy_field_value(fname, fval)]
+        return dict([fname, fval if is_immutable(fval) else self.copy_field_value(fname, fval)]
                     for fname, fval in fields.iteritems())
-    def self_build(self, field_pos_list=None):
-        if self.raw_packet_cache is not None:
-            for fname, fval in self.raw_packet_cache_fields.iteritems():
-                if self.getfieldval(fname) != fval:
+    def payload_checksum(self, head, pay):
+        """DEV: returns checksum(head+pay). While a packet set is expanded
+by __iter__(), the sum of the words of pay is remembered and shared by all
+its packets, so that only head is summed again when pay has not changed."""
+        memo = self.checksum_memo
+        if not memo or len(pay) < 128 or len(head) % 2 == 1:
+            return checksum(head+pay)
+        last = memo[0]
+        if last is not None and (last[0] is pay or last[0] == pay):
+            s = last[1]
+        else:
+            s = checksum_sum(pay)
+            memo[0] = (pay, s)
+        return checksum_fold(checksum_sum(head)+s)
+
+    def check_raw_packet_cache(self):
+        """DEV: drops .raw_packet_cache if a list or a packet held by a field
+has been changed in place since the dissection. Returns True if the cache
+is still valid."""
+        if self.raw_packet_cache is None:
+            return False
+        if self.raw_packet_cache_fields is not None:
+            for fname, snapshot in self.raw_packet_cache_fields.iteritems():
+                if not raw_unchanged(self.getfieldval(fname), snapshot):
                     self.raw_packet_cache = None
                     self.raw_packet_cache_fields = None
-                    break
-            if self.raw_packet_cache is not None:
-                return self.raw_packet_cache
+                    return False
+        return True
+
+    def raw_packet_cache_len(self):
+        """DEV: returns the number of dissected bytes held in the caches of
+this layer and of its payload, or None if one of them has been changed"""
+        l = 0
+        p = self
+        while not isinstance(p, NoPayload):
+            if p.post_transforms or not p.check_raw_packet_cache():
+                return None
+            l += len(p.raw_packet_cache)
+            if p.lazy_payload is not None:
+                cls,s,pad,pkt = p.lazy_payload
+                return l+len(s)+len(pad or "")
+            p = p.payload
+        return l
+
+    def self_build(self, field_pos_list=None):
+        if self.check_raw_packet_cache():
+            return self.raw_packet_cache
+        if self.fields_desc is self.__class__.fields_desc:
+            plan = self.build_plan
+        else:
+            plan = [ (None, f, None) for f in self.fields_desc ]
+        getfieldval = self.getfieldval
         p=""
-        for f in self.fields_desc:
-            val = self.getfieldval(f.name)
-            if isinstance(val, RawVal):
-                sval = str(val)
-                p += sval
-                if field_pos_list is not None:
-                    field_pos_list.append( (f.name, sval.encode("string_escape"), len(p), len(sval) ) )
-            else:
-                p = f.addfield(self, p, val)
+        for st,items,flds in plan:
+            if st is None:
+                p = self._do_addfield(items, p, field_pos_list)
+                continue
+            if type(p) is str:
+                args = []
+                for f,i2m,bits in items:
+                    if bits is None:
+                        val = getfieldval(f.name)
+                        if isinstance(val, RawVal):
+                            break
+                        if i2m:
+                            val = f.i2m(self, val)
+                        elif val is None:
+                            val = 0
+                        args.append(val)
+                        continue
+                    v = 0
+                    for f,shift,mask,i2m in bits:
+                        val = getfieldval(f.name)
+                        if isinstance(val, RawVal):
+                            break
+                        if i2m:
+                            val = f.i2m(self, val)
+                        elif val is None:
+                            val = 0
+                        if f.rev:
+                            val = f.reverse(val)
+                        v |= (val & mask) << shift
+                    else:
+                        args.append(v)
+                        continue
+                    break
+                else:
+                    try:
+                        p += st.pack(*args)
+                        continue
+                    except struct.error:
+                        pass # let the fields raise the exception
+            for f in flds:
+                p = self._do_addfield(f, p, field_pos_list)
+        return p
+
+    def _do_addfield(self, f, p, field_pos_list=None):
+        val = self.getfieldval(f.name)
+        if isinstance(val, RawVal):
+            sval = str(val)
+            p += sval
+            if field_pos_list is not None:
+                field_pos_list.append( (f.name, sval.encode("string_escape"), len(p), len(sval) ) )
+        else:
+            p = f.addfield(self, p, val)
         return p
 
     def do_build_payload(self):
@@ -343,7 +522,15 @@ class Packet(BasePacket):
     def build_padding(self):
         return self.payload.build_padding()
 
+    def is_unchanged(self):
+        """Tells whether the packet is the one it was dissected from, and
+thus builds to the dissected string"""
+        return bool(self.original) and self.raw_packet_cache_len() == len(self.original)
+
     def build(self):
+        if self.is_unchanged():
+            # nothing has been changed since the dissection
+            return self.original
         p = self.do_build()
         p += self.build_padding()
         p = self.build_done(p)
@@ -572,43 +759,92 @@ Creates an EPS file describing a packet. If filename is not provided a temporary
         return s
 
     def do_dissect(self, s):
-        flist = self.fields_desc[:]
-        flist.reverse()
         raw = s
-        self.raw_packet_cache_fields = {}
-        while s and flist:
-            f = flist.pop()
-            s, fval = f.getfield(self, s)
-            # We need to track fields with mutable values to discard
-            # .raw_packet_cache when needed.
-            if f.islist or f.holds_packets:
-                self.raw_packet_cache_fields[f.name] = f.do_copy(fval)
-            self.fields[f.name] = fval
+        cache_fields = None
+        fields = self.fields
+        if self.fields_desc is self.__class__.fields_desc:
+            plan = self.dissect_plan
+        else:
+            plan = [ (None, f, f.islist or f.holds_packets) for f in self.fields_desc ]
+        for st,items,flds in plan:
+            if not s:
+                break
+            if st is None:
+                # items is a field that can not be unpacked with struct
+                s, fval = items.getfield(self, s)
+                # We need to track fields with mutable values to discard
+                # .raw_packet_cache when needed.
+                if flds:
+                    if cache_fields is None:
+                        cache_fields = {}
+                    cache_fields[items.name] = raw_snapshot(items, fval)
+                fields[items.name] = fval
+            elif type(s) is str and len(s) >= st.size:
+                for (f,m2i,bits),val in zip(items, st.unpack_from(s)):
+                    if bits is None:
+                        fields[f.name] = f.m2i(self, val) if m2i else val
+                    else:
+                        val = long(val)
+                        for f,shift,mask,m2i in bits:
+                            fval = (val >> shift) & mask
+                            if f.rev:
+                                fval = f.reverse(fval)
+                            fields[f.name] = f.m2i(self, fval) if m2i else fval
+                s = s[st.size:]
+            else:
+                for f in flds:
+                    if not s:
+                        break
+                    s, fields[f.name] = f.getfield(self, s)
         assert(raw.endswith(s))
+        # The payload is not dissected yet, so these attributes can not be
+        # fields of an upper layer: bypass __setattr__
+        self.__dict__["raw_packet_cache_fields"] = cache_fields
         if s:
-            self.raw_packet_cache = raw[:-len(s)]
+            self.__dict__["raw_packet_cache"] = raw[:-len(s)]
         else:
-            self.raw_packet_cache = raw
-        self.explicit = 1
+            self.__dict__["raw_packet_cache"] = raw
+        self.__dict__["explicit"] = 1
         return s
 
     def do_dissect_payload(self, s):
         if s:
             cls = self.guess_payload_class(s)
-            try:
-                p = cls(s, _internal=1, _underlayer=self)
-            except KeyboardInterrupt:
-                raise
-            except:
-                if conf.debug_dissector:
-                    if isinstance(cls,type) and issubclass(cls,Packet):
-                        log_runtime.error("%s dissector failed" % cls.name)
-                    else:
-                        log_runtime.error("%s.guess_payload_class() returned [%s]" % (self.__class__.__name__,repr(cls)))
-                    if cls is not None:
-                        raise
-                p = conf.raw_layer(s, _internal=1, _underlayer=self)
-            self.add_payload(p)
+            if conf.lazy_dissect:
+                # [class, string, padding, dissection_done() argument]
+                self.__dict__["lazy_payload"] = [cls, s, None, None]
+                del(self.__dict__["payload"])
+            else:
+                self.add_payload(self.dissect_payload_as(cls, s))
+
+    def dissect_payload_as(self, cls, s):
+        """DEV: dissects s as a payload of class cls. Falls back on conf.raw_layer when cls fails"""
+        try:
+            p = cls(s, _internal=1, _underlayer=self)
+        except KeyboardInterrupt:
+            raise
+        except:
+            if conf.debug_dissector:
+                if isinstance(cls,type) and issubclass(cls,Packet):
+                    log_runtime.error("%s dissector failed" % cls.name)
+                else:
+                    log_runtime.error("%s.guess_payload_class() returned [%s]" % (self.__class__.__name__,repr(cls)))
+                if cls is not None:
+                    raise
+            p = conf.raw_layer(s, _internal=1, _underlayer=self)
+        return p
+
+    def do_dissect_lazy_payload(self):
+        """DEV: dissects the payload left aside by conf.lazy_dissect and returns it"""
+        cls,s,pad,pkt = self.lazy_payload
+        self.__dict__["lazy_payload"] = None
+        self.__dict__["payload"] = NoPayload()
+        self.add_payload(self.dissect_payload_as(cls, s))
+        if pad:
+            self.add_payload(conf.padding_layer(pad))
+        if pkt is not None:
+            self.payload.dissection_done(pkt)
+        return self.payload
 
     def dissect(self, s):
         s = self.pre_dissect(s)
@@ -620,20 +856,43 @@ Creates an EPS file describing a packet. If filename is not provided a temporary
         payl,pad = self.extract_padding(s)
         self.do_dissect_payload(payl)
         if pad and conf.padding:
-            self.add_payload(conf.padding_layer(pad))
+            if self.lazy_payload is not None:
+                self.lazy_payload[2] = pad
+            else:
+                self.add_payload(conf.padding_layer(pad))
 
 
     def guess_payload_class(self, payload):
         """DEV: Guesses the next payload class from layer bonds. Can be overloaded to use a different mechanism."""
         for t in self.aliastypes:
-            for fval, cls in t.payload_guess:
-                ok = 1
-                for k in fval.keys():
-                    if not hasattr(self, k) or fval[k] != self.getfieldval(k):
-                        ok = 0
+            index = t.payload_guess_index
+            if index is None or index[0] is not t.payload_guess:
+                index = index_payload_guess(t)
+            # bonds are bucketed on the value of one of their fields,
+            # only the buckets matching our values need to be checked
+            buckets = [index[2]]
+            for k, values in index[1]:
+                try:
+                    bucket = values.get(self.getfieldval(k))
+                except (AttributeError, TypeError):
+                    continue
+                if bucket is not None:
+                    buckets.append(bucket)
+            best = None
+            for bucket in buckets:
+                for pos, fval, cls in bucket:
+                    if best is not None and pos > best[0]:
                         break
-                if ok:
-                    return cls
+                    ok = 1
+                    for k in fval.keys():
+                        if not hasattr(self, k) or fval[k] != self.getfieldval(k):
+                            ok = 0
+                            break
+                    if ok:
+                        best = pos, cls
+                        break
+            if best is not None:
+                return best[1]
         return self.default_payload_class(payload)
     
     def default_payload_class(self, payload):
@@ -642,6 +901,8 @@ Creates an EPS file describing a packet. If filename is not provided a temporary
 
     def hide_defaults(self):
         """Removes fields' values that are the same as default values."""
+        if self.shared_fields:
+            self.unshare_fields()
         for k in self.fields.keys():
             if self.default_fields.has_key(k):
                 if self.default_fields[k] == self.fields[k]:
@@ -652,20 +913,25 @@ Creates an EPS file describing a packet. If filename is not provided a temporary
         pkt = self.__class__()
         pkt.explicit = 1
         pkt.fields = kargs
-        pkt.default_fields = self.copy_fields_dict(self.default_fields)
+        if self.default_fields is not self.__class__.default_fields:
+            pkt.default_fields = self.copy_fields_dict(self.default_fields)
         pkt.time = self.time
+        if self.time_ns is not None:
+            pkt.__dict__["time_ns"] = self.time_ns
         pkt.underlayer = self.underlayer
-        pkt.overload_fields = self.overload_fields.copy()
+        if "overload_fields" in self.__dict__:
+            pkt.overload_fields = self.overload_fields.copy()
         pkt.post_transforms = self.post_transforms
         pkt.raw_packet_cache = self.raw_packet_cache
-        pkt.raw_packet_cache_fields = self.copy_fields_dict(
-            self.raw_packet_cache_fields
-        )
+        # the snapshots are not modified and pkt holds the same values
+        pkt.raw_packet_cache_fields = self.raw_packet_cache_fields
         if payload is not None:
             pkt.add_payload(payload)
         return pkt
 
     def __iter__(self):
+        # the packets of the set usually carry the same payload
+        memo = [None]
         def loop(todo, done, self=self):
             if todo:
                 eltname = todo.pop()
@@ -690,7 +956,15 @@ Creates an EPS file describing a packet. If filename is not provided a temporary
                         if isinstance(done2[k], VolatileValue):
                             done2[k] = done2[k]._fix()
                     pkt = self.clone_with(payload=payl, **done2)
+                    pkt.__dict__["checksum_memo"] = memo
+                    yield pkt
+        def expand(todo, done):
+            try:
+                for pkt in loop(todo, done):
                     yield pkt
+            finally:
+                # do not keep the last payload alive with the packets
+                del memo[:]
 
         if self.explicit or self.raw_packet_cache is not None:
             todo = []
@@ -700,7 +974,33 @@ Creates an EPS file describing a packet. If filename is not provided a temporary
                                                     self.overloaded_fields.iteritems())
                      if isinstance(v, VolatileValue) ] + self.fields.keys()
             done = {}
-        return loop(todo, done)
+        return expand(todo, done)
+
+    def iter_raw(self):
+        """Returns a generator of the built strings of the packets of the
+set described by the instance (see RawTemplateGen)"""
+        return RawTemplateGen(self)
+
+    def raw_checksums(self, s, off, uoff):
+        """DEV: describes the internet checksums of this layer, the packet
+being built in s with this layer at offset off and its underlayer at
+offset uoff. Returns a list of (position, ranges), ranges being the
+(start, end) parts of s covered by the checksum at position, or None if
+they cannot be described. A layer overriding post_build() must also override
+raw_checksums() for its fields to be patched by RawTemplateGen."""
+        return []
+
+    def raw_pseudo_header(self, s, off):
+        """DEV: returns the (start, end) parts of s (where this layer is built
+at offset off) that go in the pseudo header of the checksum of the upper
+layer, and the end of the data it covers. None if not applicable."""
+        return None
+
+    def raw_route_fields(self):
+        """DEV: names of the fields of this layer that select its route.
+Other fields are computed from the route (e.g. IP.src, Ether.dst), so a
+template cannot be patched when one of them changes."""
+        return []
 
     def __gt__(self, other):
         """True if other is an answer from self (self ==> other)."""
@@ -1181,16 +1481,246 @@ conf.padding_layer = Padding
 if conf.default_l2 is None:
     conf.default_l2 = Raw
 
+###################
+## Raw expansion ##
+###################
+
+class RawTemplateGen(Gen):
+    """Expands a packet like Packet.__iter__() does, but yields the built
+strings instead of the packets. The first packet is built once, and the
+next ones are obtained by patching the fields that change in its bytes
+and updating the internet checksums that cover them (see
+Packet.raw_checksums()).
+
+The first packet in which each field changes is checked against a regular
+build. If they differ, or if a field cannot be patched in place (its built
+size changes, it is not byte aligned...), the packets are built one by one
+again. They are also built one by one when a field that selects the route
+changes (see Packet.raw_route_fields()), as the values computed from the
+route (e.g. IP.src) may then change with it, and when other fields of its
+layer may depend on a field that changes (see patchable()).
+"""
+    def __init__(self, pkt):
+        self.pkt = pkt
+    def __repr__(self):
+        return "<RawTemplateGen %s>" % self.pkt.summary()
+
+    def dimensions(self):
+        """Returns the (layer index, field name, values) of the fields that
+take more than one value, in the order of the loops of Packet.__iter__().
+values is the VolatileValue itself for the volatile values, which change
+for every packet."""
+        dims = []
+        i = 0
+        p = self.pkt
+        while not isinstance(p, NoPayload):
+            if not (p.explicit or p.raw_packet_cache is not None):
+                todo = [ k for (k,v) in itertools.chain(p.default_fields.iteritems(),
+                                                        p.overloaded_fields.iteritems())
+                         if isinstance(v, VolatileValue) ] + p.fields.keys()
+                for k in reversed(todo):
+                    elt = p.getfieldval(k)
+                    if not isinstance(elt, Gen):
+                        if p.get_field(k).islist:
+                            elt = SetGen([elt])
+                        else:
+                            elt = SetGen(elt)
+                    vals = list(itertools.islice(elt, 2))
+                    if len(vals) > 1:
+                        dims.append((i, k, elt))
+                    elif vals and isinstance(vals[0], VolatileValue):
+                        dims.append((i, k, vals[0]))
+            i += 1
+            p = p.payload
+        return dims
+
+    def expand(self, dims, vals, j=0):
+        if j == len(dims):
+            yield vals
+            return
+        elt = dims[j][2]
+        if isinstance(elt, VolatileValue):
+            elt = [elt]
+        for v in elt:
+            vals[j] = v
+            for x in self.expand(dims, vals, j+1):
+                yield x
+
+    def __iter__(self):
+        gen = iter(self.pkt)
+        try:
+            first = gen.next()
+        except StopIteration:
+            return
+        raw = str(first)
+        yield raw
+        dims = self.dimensions()
+        if not dims:
+            return
+        layers = []
+        p = first
+        while not isinstance(p, NoPayload):
+            layers.append(p)
+            p = p.payload
+        offs = [len(raw)-len(str(l)) for l in layers]
+        # checksums, inner ones first as outer ones may cover them
+        cks = []
+        for i in xrange(len(layers)-1,-1,-1):
+            c = layers[i].raw_checksums(raw, offs[i], offs[i-1] if i else None)
+            if c is None:
+                cks = None
+                break
+            cks += c
+        patches = []
+        if cks is not None:
+            for i,k,elt in dims:
+                layer = layers[i]
+                if k in layer.raw_route_fields() or not self.patchable(layer):
+                    patches = None
+                    break
+                fld = layer.get_field(k)
+                f0 = fld.addfield(layer, "", layer.getfieldval(k))
+                pre = ""
+                for f in layer.fields_desc:
+                    if f.name == k:
+                        break
+                    pre = f.addfield(layer, pre, layer.getfieldval(f.name))
+                if type(pre) is not str or type(f0) is not str or not f0:
+                    patches = None
+                    break
+                pos = offs[i]+len(pre)
+                patches.append((layer, fld, pos, self.covering(cks, pos, len(f0)), f0))
+        if not patches or None in [c for _,_,_,c,_ in patches]:
+            patches = None
+        else:
+            ckcover = [self.covering(cks, pos, 2) for pos,_ in cks]
+            if None in ckcover:
+                patches = None
+        frame = bytearray(raw)
+        cur = [f0 for _,_,_,_,f0 in patches or []]
+        ckv = [struct.unpack("!H", raw[pos:pos+2])[0] for pos,_ in cks or []]
+        checked = [0]*len(dims)
+        vals = [None]*len(dims)
+        elts = self.expand(dims, vals)
+        elts.next()
+        for vals in elts:
+            fixed = [ v._fix() if isinstance(v, VolatileValue) else v for v in vals ]
+            verify = 0
+            if patches is not None:
+                ck0 = ckv[:]
+                for j,(layer,fld,pos,cover,f0) in enumerate(patches):
+                    b = fld.addfield(layer, "", fixed[j])
+                    if b == cur[j]:
+                        continue
+                    if type(b) is not str or len(b) != len(f0):
+                        patches = None
+                        break
+                    frame[pos:pos+len(b)] = b
+                    if not checked[j]:
+                        checked[j] = verify = 1
+                    for c,odd in cover:
+                        ckv[c] = checksum_update(ckv[c], cur[j], b, odd)
+                    cur[j] = b
+            if patches is not None:
+                for c in xrange(len(ckv)):
+                    if ckv[c] != ck0[c]:
+                        pos = cks[c][0]
+                        b = struct.pack("!H", ckv[c])
+                        for c2,odd in ckcover[c]:
+                            ckv[c2] = checksum_update(ckv[c2], str(frame[pos:pos+2]), b, odd)
+                        frame[pos:pos+2] = b
+                s = str(frame)
+                if verify:
+                    if s != str(self.build(first, dims, fixed)):
+                        patches = None
+            if patches is None:
+                s = str(self.build(first, dims, fixed))
+            yield s
+
+    def patchable(self, layer):
+        """Tells whether the fields of layer can be patched in the template,
+i.e. whether no other field can depend on their values when it is built:
+no conditional field, no StrFixedLenField (its length may be read from
+another field), and no post_build() other than the one described by
+raw_checksums(). (Other lengths and counts read from fields only matter
+to the dissection.)"""
+        cls = layer.__class__
+        if (cls.post_build.im_func is not Packet.post_build.im_func and
+            cls.raw_checksums.im_func is Packet.raw_checksums.im_func):
+            return False
+        for f in layer.fields_desc:
+            if isinstance(f, ConditionalField) or isinstance(f, StrFixedLenField):
+                return False
+        return True
+
+    def covering(self, cks, pos, l):
+        """Returns the (checksum index, odd) of the checksums covering the l
+bytes at pos, or None if one of them only covers a part of them"""
+        res = []
+        for c,(cpos,ranges) in enumerate(cks):
+            if pos < cpos+2 and cpos < pos+l:
+                if (cpos, l) != (pos, 2):
+                    return None
+                continue
+            for a,b in ranges:
+                if a <= pos and pos+l <= b:
+                    res.append((c, (pos-ranges[0][0]) % 2))
+                    break
+                elif pos < b and a < pos+l:
+                    return None
+        return res
+
+    def build(self, first, dims, fixed):
+        """Returns a copy of first with the given values for the dimensions"""
+        pkt = first.copy()
+        layers = []
+        p = pkt
+        while not isinstance(p, NoPayload):
+            layers.append(p)
+            p = p.payload
+        for (i,k,elt),v in zip(dims, fixed):
+            layers[i].setfieldval(k, v)
+        return pkt
+
+
 #################
 ## Bind layers ##
 #################
 
 
+def index_payload_guess(cls):
+    """DEV: builds the dispatch table used by guess_payload_class() from
+cls.payload_guess and stores it in cls.payload_guess_index. Each bond is
+bucketed on the value of its most commonly bound field, as
+{field name: {value: [(position, other fields' values, upper), ...]}}.
+Bonds that cannot be hashed are kept in a list to be scanned."""
+    count = {}
+    for fval, upper in cls.payload_guess:
+        for k in fval:
+            count[k] = count.get(k, 0)+1
+    keyed = {}
+    scanned = []
+    for pos, (fval, upper) in enumerate(cls.payload_guess):
+        for k in sorted(fval, key=lambda k: (-count[k], k)):
+            rest = fval.copy()
+            v = rest.pop(k)
+            try:
+                hash(v)
+            except TypeError:
+                continue
+            keyed.setdefault(k, {}).setdefault(v, []).append((pos, rest, upper))
+            break
+        else:
+            scanned.append((pos, fval, upper))
+    cls.payload_guess_index = index = (cls.payload_guess, keyed.items(), scanned)
+    return index
+
 def bind_bottom_up(lower, upper, __fval=None, **fval):
     if __fval is not None:
         fval.update(__fval)
     lower.payload_guess = lower.payload_guess[:]
     lower.payload_guess.append((fval, upper))
+    index_payload_guess(lower)
     
 
 def bind_top_down(lower, upper, __fval=None, **fval):
@@ -1218,6 +1748,7 @@ def split_bottom_up(lower, upper, __fval=None, **fval):
                 return True
         return False
     lower.payload_guess = filter(do_filter, lower.payload_guess)
+    index_payload_guess(lower)
         
 def split_top_down(lower, upper, __fval=None, **fval):
     if __fval is not None:
@@ -1278,6 +1809,7 @@ def fuzz(p, _inplace=0):
         p = p.copy()
     q = p
     while not isinstance(q, NoPayload):
+        q.default_fields = q.default_fields.copy()
         for f in q.fields_desc:
             if isinstance(f, PacketListField):
                 for r in getattr(q, f.name):
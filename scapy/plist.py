@@ -8,12 +8,13 @@ PacketList: holds several packets and allows to do operations on them.
 """
 
 
-import os,subprocess
+import os,subprocess,array
 from config import conf
 from base_classes import BasePacket,BasePacketList
 from collections import defaultdict
+from itertools import izip,islice,tee
 
-from utils import do_graph,hexdump,make_table,make_lined_table,make_tex_table,get_temp_file
+from utils import do_graph,hexdump,make_table,make_lined_table,make_tex_table,get_temp_file,PcapSequence
 
 import arch
 if arch.GNUPLOT:
@@ -105,15 +106,15 @@ lfilter: truth function to apply to each packet to decide whether it will be dis
         """prints a summary of each packet with the packet's number
 prn:     function to apply to each packet instead of lambda x:x.summary()
 lfilter: truth function to apply to each packet to decide whether it will be displayed"""
-        for i in range(len(self.res)):
+        for i,r in enumerate(self.res):
             if lfilter is not None:
-                if not lfilter(self.res[i]):
+                if not lfilter(r):
                     continue
             print conf.color_theme.id(i,fmt="%04i"),
             if prn is None:
-                print self._elt2sum(self.res[i])
+                print self._elt2sum(r)
             else:
-                print prn(self.res[i])
+                print prn(r)
     def display(self): # Deprecated. Use show()
         """deprecated. is show()"""
         self.show()
@@ -140,10 +141,7 @@ lfilter: truth function to apply to each packet to decide whether it will be dis
         """Applies a function to each packet to get a value that will be plotted with GnuPlot. A gnuplot object is returned
         lfilter: a truth function that decides whether a packet must be ploted"""
         g=Gnuplot.Gnuplot()
-        l = self.res
-        if lfilter is not None:
-            l = filter(lfilter, l)
-        l = map(f,l)
+        l = [f(e) for e in self.res if lfilter is None or lfilter(e)]
         g.plot(Gnuplot.Data(l, **kargs))
         return g
 
@@ -151,22 +149,18 @@ lfilter: truth function to apply to each packet to decide whether it will be dis
         """diffplot(f, delay=1, lfilter=None)
         Applies a function to couples (l[i],l[i+delay])"""
         g = Gnuplot.Gnuplot()
-        l = self.res
-        if lfilter is not None:
-            l = filter(lfilter, l)
-        l = map(f,l[:-delay],l[delay:])
+        l1,l2 = tee(e for e in self.res if lfilter is None or lfilter(e))
+        l = [f(x,y) for x,y in izip(l1,islice(l2,delay,None))]
         g.plot(Gnuplot.Data(l, **kargs))
         return g
 
     def multiplot(self, f, lfilter=None, **kargs):
         """Uses a function that returns a label and a value for this label, then plots all the values label by label"""
         g=Gnuplot.Gnuplot()
-        l = self.res
-        if lfilter is not None:
-            l = filter(lfilter, l)
-
         d={}
-        for e in l:
+        for e in self.res:
+            if lfilter is not None and not lfilter(e):
+                continue
             k,v = f(e)
             if k in d:
                 d[k].append(v)
@@ -188,43 +182,43 @@ lfilter: truth function to apply to each packet to decide whether it will be dis
     def hexraw(self, lfilter=None):
         """Same as nsummary(), except that if a packet has a Raw layer, it will be hexdumped
         lfilter: a truth function that decides whether a packet must be displayed"""
-        for i in range(len(self.res)):
-            p = self._elt2pkt(self.res[i])
+        for i,r in enumerate(self.res):
+            p = self._elt2pkt(r)
             if lfilter is not None and not lfilter(p):
                 continue
             print "%s %s %s" % (conf.color_theme.id(i,fmt="%04i"),
                                 p.sprintf("%.time%"),
-                                self._elt2sum(self.res[i]))
+                                self._elt2sum(r))
             if p.haslayer(conf.raw_layer):
                 hexdump(p.getlayer(conf.raw_layer).load)
 
     def hexdump(self, lfilter=None):
         """Same as nsummary(), except that packets are also hexdumped
         lfilter: a truth function that decides whether a packet must be displayed"""
-        for i in range(len(self.res)):
-            p = self._elt2pkt(self.res[i])
+        for i,r in enumerate(self.res):
+            p = self._elt2pkt(r)
             if lfilter is not None and not lfilter(p):
                 continue
             print "%s %s %s" % (conf.color_theme.id(i,fmt="%04i"),
                                 p.sprintf("%.time%"),
-                                self._elt2sum(self.res[i]))
+                                self._elt2sum(r))
             hexdump(p)
 
     def padding(self, lfilter=None):
         """Same as hexraw(), for Padding layer"""
-        for i in range(len(self.res)):
-            p = self._elt2pkt(self.res[i])
+        for i,r in enumerate(self.res):
+            p = self._elt2pkt(r)
             if p.haslayer(conf.padding_layer):
                 if lfilter is None or lfilter(p):
                     print "%s %s %s" % (conf.color_theme.id(i,fmt="%04i"),
                                         p.sprintf("%.time%"),
-                                        self._elt2sum(self.res[i]))
+                                        self._elt2sum(r))
                     hexdump(p.getlayer(conf.padding_layer).load)
 
     def nzpadding(self, lfilter=None):
         """Same as padding() but only non null padding"""
-        for i in range(len(self.res)):
-            p = self._elt2pkt(self.res[i])
+        for i,r in enumerate(self.res):
+            p = self._elt2pkt(r)
             if p.haslayer(conf.padding_layer):
                 pad = p.getlayer(conf.padding_layer).load
                 if pad == pad[0]*len(pad):
@@ -232,7 +226,7 @@ lfilter: truth function to apply to each packet to decide whether it will be dis
                 if lfilter is None or lfilter(p):
                     print "%s %s %s" % (conf.color_theme.id(i,fmt="%04i"),
                                         p.sprintf("%.time%"),
-                                        self._elt2sum(self.res[i]))
+                                        self._elt2sum(r))
                     hexdump(p.getlayer(conf.padding_layer).load)
         
 
@@ -345,8 +339,7 @@ lfilter: truth function to apply to each packet to decide whether it will be dis
         import pyx
         d = pyx.document.document()
         l = len(self.res)
-        for i in range(len(self.res)):
-            elt = self.res[i]
+        for i,elt in enumerate(self.res):
             c = self._elt2pkt(elt).canvas_dump(**kargs)
             cbb = c.bbox()
             c.text(cbb.left(),cbb.top()+1,r"\font\cmssfont=cmss12\cmssfont{Frame %i/%i}" % (i,l),[pyx.text.size.LARGE])
@@ -412,25 +405,29 @@ lfilter: truth function to apply to each packet to decide whether it will be dis
             remain = filter(lambda x:not hasattr(x,"_answered"), remain)
         return SndRcvList(sr),PacketList(remain)
 
+    @staticmethod
+    def session_extractor(p):
+        """DEV: the default session_extractor of sessions()"""
+        sess = "Other"
+        if 'Ether' in p:
+            if 'IP' in p:
+                if 'TCP' in p:
+                    sess = p.sprintf("TCP %IP.src%:%r,TCP.sport% > %IP.dst%:%r,TCP.dport%")
+                elif 'UDP' in p:
+                    sess = p.sprintf("UDP %IP.src%:%r,UDP.sport% > %IP.dst%:%r,UDP.dport%")
+                elif 'ICMP' in p:
+                    sess = p.sprintf("ICMP %IP.src% > %IP.dst% type=%r,ICMP.type% code=%r,ICMP.code% id=%ICMP.id%")
+                else:
+                    sess = p.sprintf("IP %IP.src% > %IP.dst% proto=%IP.proto%")
+            elif 'ARP' in p:
+                sess = p.sprintf("ARP %ARP.psrc% > %ARP.pdst%")
+            else:
+                sess = p.sprintf("Ethernet type=%04xr,Ether.type%")
+        return sess
+
     def sessions(self, session_extractor=None):
         if session_extractor is None:
-            def session_extractor(p):
-                sess = "Other"
-                if 'Ether' in p:
-                    if 'IP' in p:
-                        if 'TCP' in p:
-                            sess = p.sprintf("TCP %IP.src%:%r,TCP.sport% > %IP.dst%:%r,TCP.dport%")
-                        elif 'UDP' in p:
-                            sess = p.sprintf("UDP %IP.src%:%r,UDP.sport% > %IP.dst%:%r,UDP.dport%")
-                        elif 'ICMP' in p:
-                            sess = p.sprintf("ICMP %IP.src% > %IP.dst% type=%r,ICMP.type% code=%r,ICMP.code% id=%ICMP.id%")
-                        else:
-                            sess = p.sprintf("IP %IP.src% > %IP.dst% proto=%IP.proto%")
-                    elif 'ARP' in p:
-                        sess = p.sprintf("ARP %ARP.psrc% > %ARP.pdst%")
-                    else:
-                        sess = p.sprintf("Ethernet type=%04xr,Ether.type%")
-                return sess
+            session_extractor = self.session_extractor
         sessions = defaultdict(self.__class__)
         for p in self.res:
             sess = session_extractor(self._elt2pkt(p))
@@ -476,6 +473,60 @@ lfilter: truth function to apply to each packet to decide whether it will be dis
         
 
 
+class PcapPacketList(PacketList):
+    """A PacketList whose packets stay in a capture file and are dissected
+when they are needed (see PcapSequence), so that it is analysed in constant
+memory. Filtering it, slicing it or splitting it in sessions gives lists of
+the same kind, which only hold the numbers of the records they select
+ex: PcapPacketList("big.pcap").filter(lambda x: TCP in x).sessions()"""
+    def __init__(self, res=None, name=None, stats=None, cache_size=None):
+        """res: the name of a capture file, or a PcapSequence
+           cache_size: number of packets kept in memory for random access"""
+        if isinstance(res, basestring):
+            res = PcapSequence(res, cache_size=cache_size)
+        if name is None:
+            name = os.path.basename(res.filename) if isinstance(res, PcapSequence) else "PacketList"
+        PacketList.__init__(self, res, name, stats)
+    def _select(self, func, name):
+        """DEV: list of the packets of self for which func() is true"""
+        if not isinstance(self.res, PcapSequence): # not backed by a file
+            return self.__class__(filter(func, self.res), name=name, stats=self.stats)
+        numbers = array.array("l", (n for n,p in izip(self.res.records(), self.res) if func(p)))
+        return self.__class__(self.res.select(numbers), name=name, stats=self.stats)
+    def __getitem__(self, item):
+        if isinstance(item,type) and issubclass(item,BasePacket):
+            return self._select(lambda x: item in self._elt2pkt(x),
+                                "%s from %s"%(item.__name__,self.listname))
+        return PacketList.__getitem__(self, item)
+    def __add__(self, other):
+        if (isinstance(self.res, PcapSequence) and isinstance(other.res, PcapSequence)
+            and self.res.filename == other.res.filename):
+            numbers = array.array("l", self.res.records())
+            numbers.extend(other.res.records())
+            return self.__class__(self.res.select(numbers),
+                                  name="%s+%s"%(self.listname,other.listname))
+        return PacketList(list(self.res)+list(other.res),
+                          name="%s+%s"%(self.listname,other.listname))
+    def filter(self, func):
+        """Returns a packet list filtered by a truth function"""
+        return self._select(func, "filtered %s"%self.listname)
+    def sessions(self, session_extractor=None):
+        if not isinstance(self.res, PcapSequence):
+            return PacketList.sessions(self, session_extractor)
+        if session_extractor is None:
+            session_extractor = self.session_extractor
+        sessions = defaultdict(lambda: array.array("l"))
+        for n,p in izip(self.res.records(), self.res):
+            sessions[session_extractor(self._elt2pkt(p))].append(n)
+        return dict((sess, self.__class__(self.res.select(numbers), name=sess, stats=self.stats))
+                    for sess,numbers in sessions.iteritems())
+    def sr(self,multi=0):
+        """sr([multi=1]) -> (SndRcvList, PacketList)
+        Matches packets in the list and return ( (matched couples), (unmatched packets) )
+        The packets are loaded in memory to be matched"""
+        return PacketList(list(self.res), name=self.listname).sr(multi)
+
+
 class SndRcvList(PacketList):
     def __init__(self, res=None, name="Results", stats=None):
         PacketList.__init__(self, res, name, stats)
@@ -85,15 +85,16 @@ class Inject3Sink(InjectSink):
     
 class WrpcapSink(Sink):
     """Packets received on low input are written to PCA file
+(PcapWriter options, e.g. for rotation, are accepted)
      +----------+
   >>-|          |->>
      |          |
    >-|--[pcap]  |->
      +----------+
 """
-    def __init__(self, fname, name=None):
+    def __init__(self, fname, name=None, **kargs):
         Sink.__init__(self, name=name)
-        self.f = PcapWriter(fname)
+        self.f = PcapWriter(fname, **kargs)
     def stop(self):
         self.f.flush()
     def push(self, msg):
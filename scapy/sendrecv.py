@@ -7,13 +7,14 @@
 Functions to send and receive packets.
 """
 
-import cPickle,os,sys,time,subprocess
+import cPickle,os,sys,time,subprocess,collections,threading,Queue,socket,errno
 from select import select
+from itertools import islice
 from data import *
 import arch
 from config import conf
-from packet import Gen
-from utils import warning,get_temp_file,PcapReader,wrpcap
+from packet import Gen,RawTemplateGen
+from utils import warning,get_temp_file,PcapReader,PcapWriter,wrpcap,get_time_ns
 import plist
 from error import log_runtime,log_interactive
 from base_classes import SetGen
@@ -33,9 +34,134 @@ class debug:
 ####################
 
 
+def _sleep_until(t):
+    """Sleeps until time t, spinning for the last millisecond for precision"""
+    st = t-time.time()
+    if st > 0.001:
+        time.sleep(st-0.001)
+    while time.time() < t:
+        pass
 
+class TokenBucket:
+    """Paces the packets sent through send() to <pps> packets per second and/or
+<mbps> Mbit/s, letting <burst> packets go back to back, and counts them.
+Each packet pushes the theoretical time of the next one by its cost (a token
+bucket in its virtual scheduling form), and send() waits until that time,
+minus the burst tolerance, sleeping then spinning for the last millisecond"""
+    def __init__(self, pps=None, mbps=None, burst=1):
+        self.pcost = 1.0/pps if pps else 0
+        self.bcost = 8e-6/mbps if mbps else 0 # seconds per byte
+        self.burst = max(burst, 1)
+        self.paced = bool(self.pcost or self.bcost)
+        self.cost = self.pcost
+        self.start = self.tat = time.time()
+        self.packets = self.bytes = self.drops = 0
+
+    def next_time(self):
+        """time from which the next packet can be sent"""
+        return self.tat-(self.burst-1)*self.cost
+
+    def send(self, s, p):
+        """sends p through the socket s when it is time to. A packet the kernel
+could not queue (ENOBUFS, EAGAIN) is counted as dropped"""
+        t = time.time() # a packet ready before its time is not late
+        if self.paced:
+            _sleep_until(self.next_time())
+        try:
+            n = s.send(p)
+        except socket.error,msg:
+            if msg.errno not in (errno.ENOBUFS, errno.EAGAIN):
+                raise
+            self.drops += 1
+            return
+        self.packets += 1
+        if n is None: # the socket does not tell what it sent
+            n = len(p) if self.bcost else 0
+        self.bytes += n
+        self.cost = max(self.pcost, n*self.bcost)
+        self.tat = max(self.tat, t)+self.cost
+
+    def send_batch(self, s, pkts):
+        """sends the packets of pkts at once with s.send_batch() if they are
+not paced, one by one with send() otherwise. A packet the kernel could not
+queue is counted as dropped, and the following ones are still sent"""
+        if self.paced:
+            for p in pkts:
+                self.send(s, p)
+            return
+        while pkts:
+            try:
+                self.bytes += s.send_batch(pkts)
+                self.packets += len(pkts)
+                return
+            except socket.error,msg:
+                if msg.errno not in (errno.ENOBUFS, errno.EAGAIN):
+                    raise
+                self.packets += msg.sent
+                self.bytes += msg.nbytes
+                self.drops += 1
+                pkts = pkts[msg.sent+1:]
+
+    def report(self):
+        """the achieved rate, as printed by the sending loops"""
+        dt = max(time.time()-self.start, 1e-9)
+        rate = "%.1f pps" % (self.packets/dt)
+        if self.bytes:
+            rate += ", %.3f Mbps" % (self.bytes*8e-6/dt)
+        return "%i packets in %.3fs (%s, %i dropped)" % (self.packets, dt, rate, self.drops)
+
+
+def _sndrcv_send(pks, tobesent, inter, verbose, bucket):
+    """DEV: sends the packets of sndrcv(), from the child process or the thread
+of its engine (see conf.sndrcv_engine)"""
+    try:
+        if verbose:
+            print "Begin emission:"
+        n = getattr(pks, "batch_size", 1)
+        if inter or n <= 1:
+            for p in tobesent:
+                bucket.send(pks, p)
+                if inter:
+                    time.sleep(inter)
+        else:
+            for i in xrange(0, len(tobesent), n):
+                bucket.send_batch(pks, tobesent[i:i+n])
+        if verbose:
+            print "Finished to send %s." % bucket.report()
+    except SystemExit:
+        pass
+    except KeyboardInterrupt:
+        pass
+    except:
+        log_runtime.exception("--- Error in sender %i" % os.getpid())
+        log_runtime.info("--- Error in sender %i" % os.getpid())
+
+_idle_senders = [] # job queues of the sending threads waiting for a job
+
+def _sndrcv_sender(jobs):
+    """DEV: body of the sending threads of sndrcv(). Each one sends the packets
+of the jobs of its queue, then closes their wrpipe to tell the receiving loop
+that everything has been sent"""
+    while True:
+        pks, tobesent, inter, verbose, bucket, wrpipe = jobs.get()
+        try:
+            _sndrcv_send(pks, tobesent, inter, verbose, bucket)
+        finally:
+            _idle_senders.append(jobs)
+            wrpipe.close()
 
-def sndrcv(pks, pkt, timeout = None, inter = 0, verbose=None, chainCC=0, retry=0, multi=0):
+def _sndrcv_thread_send(*job):
+    """DEV: gives a job to an idle sending thread, or to a new one"""
+    try:
+        jobs = _idle_senders.pop()
+    except IndexError:
+        jobs = Queue.Queue()
+        thread = threading.Thread(target=_sndrcv_sender, args=(jobs,))
+        thread.setDaemon(True)
+        thread.start()
+    jobs.put(job)
+
+def sndrcv(pks, pkt, timeout = None, inter = 0, verbose=None, chainCC=0, retry=0, multi=0, pps=None, mbps=None, burst=1):
     if not isinstance(pkt, Gen):
         pkt = SetGen(pkt)
         
@@ -75,29 +201,19 @@ def sndrcv(pks, pkt, timeout = None, inter = 0, verbose=None, chainCC=0, retry=0
         wrpipe=os.fdopen(wrpipe,"w")
 
         pid=1
+        threads = conf.sndrcv_engine == "threads"
+        bucket = TokenBucket(pps, mbps, burst)
         try:
-            pid = os.fork()
+            if threads:
+                # the packets, their sent_time and conf.netcache are shared
+                _sndrcv_thread_send(pks, tobesent, inter, verbose, bucket, wrpipe)
+            else:
+                pid = os.fork()
             if pid == 0:
                 try:
                     sys.stdin.close()
                     rdpipe.close()
-                    try:
-                        i = 0
-                        if verbose:
-                            print "Begin emission:"
-                        for p in tobesent:
-                            pks.send(p)
-                            i += 1
-                            time.sleep(inter)
-                        if verbose:
-                            print "Finished to send %i packets." % i
-                    except SystemExit:
-                        pass
-                    except KeyboardInterrupt:
-                        pass
-                    except:
-                        log_runtime.exception("--- Error in child %i" % os.getpid())
-                        log_runtime.info("--- Error in child %i" % os.getpid())
+                    _sndrcv_send(pks, tobesent, inter, verbose, bucket)
                 finally:
                     try:
                         os.setpgrp() # Chance process group to avoid ctrl-C
@@ -109,19 +225,25 @@ def sndrcv(pks, pkt, timeout = None, inter = 0, verbose=None, chainCC=0, retry=0
             elif pid < 0:
                 log_runtime.error("fork error")
             else:
-                wrpipe.close()
+                if not threads:
+                    wrpipe.close()
                 stoptime = 0
                 remaintime = None
                 inmask = [rdpipe,pks]
+                batch = getattr(pks, "batch_size", 1) > 1
+                backlog = collections.deque() # received by recv_batch()
                 try:
                     try:
                         while 1:
                             if stoptime:
                                 remaintime = stoptime-time.time()
-                                if remaintime <= 0:
+                                # the frames already received are answers in time
+                                if remaintime <= 0 and not backlog:
                                     break
                             r = None
-                            if arch.FREEBSD or arch.DARWIN:
+                            if backlog:
+                                inp = []
+                            elif arch.FREEBSD or arch.DARWIN:
                                 inp, out, err = select(inmask,[],[], 0.05)
                                 if len(inp) == 0 or pks in inp:
                                     r = pks.nonblock_recv()
@@ -130,11 +252,16 @@ def sndrcv(pks, pkt, timeout = None, inter = 0, verbose=None, chainCC=0, retry=0
                                 if len(inp) == 0:
                                     break
                                 if pks in inp:
-                                    r = pks.recv(MTU)
+                                    if batch:
+                                        backlog.extend(pks.recv_batch())
+                                    else:
+                                        r = pks.recv(MTU)
                             if rdpipe in inp:
                                 if timeout:
                                     stoptime = time.time()+timeout
                                 del(inmask[inmask.index(rdpipe)])
+                            if backlog:
+                                r = backlog.popleft()
                             if r is None:
                                 continue
                             ok = 0
@@ -167,15 +294,19 @@ def sndrcv(pks, pkt, timeout = None, inter = 0, verbose=None, chainCC=0, retry=0
                         if chainCC:
                             raise
                 finally:
-                    try:
-                        nc,sent_times = cPickle.load(rdpipe)
-                    except EOFError:
-                        warning("Child died unexpectedly. Packets may have not been sent %i"%os.getpid())
+                    if threads:
+                        rdpipe.read() # returns when everything has been sent
+                        rdpipe.close()
                     else:
-                        conf.netcache.update(nc)
-                        for p,t in zip(all_stimuli, sent_times):
-                            p.sent_time = t
-                    os.waitpid(pid,0)
+                        try:
+                            nc,sent_times = cPickle.load(rdpipe)
+                        except EOFError:
+                            warning("Child died unexpectedly. Packets may have not been sent %i"%os.getpid())
+                        else:
+                            conf.netcache.update(nc)
+                            for p,t in zip(all_stimuli, sent_times):
+                                p.sent_time = t
+                        os.waitpid(pid,0)
         finally:
             if pid == 0:
                 os._exit(0)
@@ -207,6 +338,116 @@ def sndrcv(pks, pkt, timeout = None, inter = 0, verbose=None, chainCC=0, retry=0
     return plist.SndRcvList(ans),plist.PacketList(remain,"Unanswered")
 
 
+def _remove_entry(lst, e):
+    """DEV: removes e from lst, comparing identities and not packets"""
+    for i in xrange(len(lst)):
+        if lst[i] is e:
+            del(lst[i])
+            return
+
+def sndrcvwindow(pks, pkt, timeout=2, window=1024, inter=0, verbose=None, chainCC=0, retry=0, multi=0, pps=None, mbps=None, burst=1):
+    """Pipelined version of sndrcv(): yields the (stimulus, answer) couples as
+the answers come, and (stimulus, None) for the stimuli still unanswered
+<timeout> seconds after having been sent <retry>+1 times. At most <window>
+stimuli wait for an answer at once, and the stimuli are generated as they are
+sent, so that the memory used depends on the window, not on the packets"""
+    if not isinstance(pkt, Gen):
+        pkt = SetGen(pkt)
+    if verbose is None:
+        verbose = conf.verb
+    if timeout is None or timeout < 0:
+        timeout = 2
+    tobesent = iter(pkt)
+    # entries: [key, stimulus, hashret, deadline, retries left, answered]
+    pending = collections.OrderedDict() # key -> entry, in the deadlines order
+    hsent = {} # hashret -> entries
+    key = nbrecv = nbans = nbunans = 0
+    bucket = TokenBucket(pps, mbps, burst)
+    nextsend = 0
+    poll = arch.FREEBSD or arch.DARWIN
+    try:
+        while 1:
+            now = time.time()
+            while tobesent is not None and len(pending) < window and now >= nextsend:
+                try:
+                    p = tobesent.next()
+                except StopIteration:
+                    tobesent = None
+                    break
+                h = p.hashret()
+                e = [key, p, h, 0, retry, False]
+                hsent.setdefault(h, []).append(e)
+                bucket.send(pks, p)
+                now = time.time()
+                e[3] = now+timeout
+                pending[key] = e
+                key += 1
+                nextsend = max(now+inter, bucket.next_time())
+            while pending:
+                e = pending[iter(pending).next()]
+                if e[3] > now:
+                    break
+                del(pending[e[0]])
+                if e[4] and not e[5]: # resend it
+                    e[4] -= 1
+                    bucket.send(pks, e[1])
+                    e[0],e[3] = key,time.time()+timeout
+                    pending[key] = e
+                    key += 1
+                    continue
+                lst = hsent[e[2]]
+                _remove_entry(lst, e)
+                if not lst:
+                    del(hsent[e[2]])
+                if not e[5]:
+                    nbunans += 1
+                    yield e[1],None
+            if tobesent is None and not pending:
+                break
+            # wait for an answer, the next deadline or the next stimulus to send
+            t = None
+            if pending:
+                t = pending[iter(pending).next()][3]-now
+            if tobesent is not None and len(pending) < window:
+                t = min(nextsend-now, t) if t is not None else nextsend-now
+            if poll:
+                t = min(t, 0.05) if t is not None else 0.05
+            inp, out, err = select([pks],[],[], max(t, 0) if t is not None else None)
+            r = None
+            if poll:
+                r = pks.nonblock_recv()
+            elif inp:
+                r = pks.recv(MTU)
+            if r is None:
+                continue
+            h = r.hashret()
+            for e in hsent.get(h, ()):
+                if r.answers(e[1]):
+                    nbans += 1
+                    if verbose > 1:
+                        os.write(1, "*")
+                    if not multi:
+                        del(pending[e[0]])
+                        lst = hsent[h]
+                        _remove_entry(lst, e)
+                        if not lst:
+                            del(hsent[h])
+                    e[5] = True
+                    yield e[1],r
+                    break
+            else:
+                if verbose > 1:
+                    os.write(1, ".")
+                nbrecv += 1
+                if conf.debug_match:
+                    debug.recv.append(r)
+    except KeyboardInterrupt:
+        if chainCC:
+            raise
+    if verbose:
+        print "\nSent %s, received %i packets, got %i answers, %i unanswered" % (bucket.report(), nbrecv+nbans, nbans, nbunans)
+
+
 def __gen_send(s, x, inter=0, loop=0, count=None, verbose=None, realtime=None, *args, **kargs):
     if type(x) is str:
         x = conf.raw_layer(load=x)
@@ -214,49 +455,73 @@ def __gen_send(s, x, inter=0, loop=0, count=None, verbose=None, realtime=None, *
         x = SetGen(x)
     if verbose is None:
         verbose = conf.verb
-    n = 0
+    bucket = TokenBucket(kargs.get("pps"), kargs.get("mbps"), kargs.get("burst", 1))
     if count is not None:
         loop = -count
     elif not loop:
         loop=-1
+    n = getattr(s, "batch_size", 1)
+    batch = not (inter or realtime or bucket.paced) and n > 1
     try:
         while loop:
             dt0 = None
+            if batch:
+                # sendmmsg(2) where available, see L2Socket.send_batch()
+                pkts = iter(x)
+                while 1:
+                    b = list(islice(pkts, n))
+                    if not b:
+                        break
+                    bucket.send_batch(s, b)
+                    if verbose:
+                        os.write(1,"."*len(b))
+                if loop < 0:
+                    loop += 1
+                continue
             for p in x:
-                if realtime:
-                    ct = time.time()
-                    if dt0:
-                        st = dt0+p.time-ct
-                        if st > 0:
-                            time.sleep(st)
+                if realtime and type(p) is not str:
+                    # delays are computed in integer nanoseconds from the
+                    # first packet, as floats of the epoch lose precision
+                    pt = get_time_ns(p)
+                    if dt0 is None:
+                        dt0 = time.time()
+                        pt0 = pt
                     else:
-                        dt0 = ct-p.time 
-                s.send(p)
-                n += 1
+                        _sleep_until(dt0+(pt-pt0)*1e-9)
+                bucket.send(s, p)
                 if verbose:
                     os.write(1,".")
-                time.sleep(inter)
+                if inter:
+                    time.sleep(inter)
             if loop < 0:
                 loop += 1
     except KeyboardInterrupt:
         pass
     s.close()
     if verbose:
-        print "\nSent %i packets." % n
+        print "\nSent %s." % bucket.report()
         
 @conf.commands.register
 def send(x, inter=0, loop=0, count=None, verbose=None, realtime=None, *args, **kargs):
     """Send packets at layer 3
-send(packets, [inter=0], [loop=0], [verbose=conf.verb]) -> None"""
-    __gen_send(conf.L3socket(*args, **kargs), x, inter=inter, loop=loop, count=count,verbose=verbose, realtime=realtime)
+send(packets, [inter=0], [loop=0], [verbose=conf.verb], [pps], [mbps], [burst=1]) -> None
+pps, mbps: rate limits, in packets per second and Mbit/s
+burst:     number of packets that can be sent back to back under the limits"""
+    rate = dict((k, kargs.pop(k)) for k in ("pps", "mbps", "burst") if k in kargs)
+    __gen_send(conf.L3socket(*args, **kargs), x, inter=inter, loop=loop, count=count,verbose=verbose, realtime=realtime,
+               **rate)
 
 @conf.commands.register
 def sendp(x, inter=0, loop=0, iface=None, iface_hint=None, count=None, verbose=None, realtime=None, *args, **kargs):
     """Send packets at layer 2
-sendp(packets, [inter=0], [loop=0], [verbose=conf.verb]) -> None"""
+sendp(packets, [inter=0], [loop=0], [verbose=conf.verb], [pps], [mbps], [burst=1]) -> None
+pps, mbps: rate limits, in packets per second and Mbit/s
+burst:     number of packets that can be sent back to back under the limits"""
     if iface is None and iface_hint is not None:
         iface = conf.route.route(iface_hint)[0]
-    __gen_send(conf.L2socket(iface=iface, *args, **kargs), x, inter=inter, loop=loop, count=count, verbose=verbose, realtime=realtime)
+    rate = dict((k, kargs.pop(k)) for k in ("pps", "mbps", "burst") if k in kargs)
+    __gen_send(conf.L2socket(iface=iface, *args, **kargs), x, inter=inter, loop=loop, count=count, verbose=verbose, realtime=realtime,
+               **rate)
 
 @conf.commands.register
 def sendpfast(x, pps=None, mbps=None, realtime=None, loop=0, file_cache=False, iface=None):
@@ -286,7 +551,10 @@ def sendpfast(x, pps=None, mbps=None, realtime=None, loop=0, file_cache=False, i
 
     f = get_temp_file()
     argv.append(f)
-    wrpcap(f, x)
+    if isinstance(x, RawTemplateGen):
+        wrpcap(f, x, linktype=conf.l2types.get(x.pkt.__class__, 1))
+    else:
+        wrpcap(f, x)
     try:
         subprocess.check_call(argv)
     except KeyboardInterrupt:
@@ -309,6 +577,8 @@ retry:    if positive, how many times to resend unanswered packets
 timeout:  how much time to wait after the last packet has been sent
 verbose:  set verbosity level
 multi:    whether to accept multiple answers for the same stimulus
+pps, mbps: rate limits of the sending, in packets per second and Mbit/s
+burst:    number of packets that can be sent back to back under the limits
 filter:   provide a BPF filter
 iface:    listen answers only on the given interface"""
     if not kargs.has_key("timeout"):
@@ -327,6 +597,8 @@ retry:    if positive, how many times to resend unanswered packets
 timeout:  how much time to wait after the last packet has been sent
 verbose:  set verbosity level
 multi:    whether to accept multiple answers for the same stimulus
+pps, mbps: rate limits of the sending, in packets per second and Mbit/s
+burst:    number of packets that can be sent back to back under the limits
 filter:   provide a BPF filter
 iface:    listen answers only on the given interface"""
     if not kargs.has_key("timeout"):
@@ -348,6 +620,8 @@ retry:    if positive, how many times to resend unanswered packets
 timeout:  how much time to wait after the last packet has been sent
 verbose:  set verbosity level
 multi:    whether to accept multiple answers for the same stimulus
+pps, mbps: rate limits of the sending, in packets per second and Mbit/s
+burst:    number of packets that can be sent back to back under the limits
 filter:   provide a BPF filter
 iface:    work only on the given interface"""
     if not kargs.has_key("timeout"):
@@ -368,6 +642,8 @@ retry:    if positive, how many times to resend unanswered packets
 timeout:  how much time to wait after the last packet has been sent
 verbose:  set verbosity level
 multi:    whether to accept multiple answers for the same stimulus
+pps, mbps: rate limits of the sending, in packets per second and Mbit/s
+burst:    number of packets that can be sent back to back under the limits
 filter:   provide a BPF filter
 iface:    work only on the given interface"""
     if not kargs.has_key("timeout"):
@@ -378,6 +654,55 @@ iface:    work only on the given interface"""
     else:
         return None
 
+@conf.commands.register
+def isr(x, filter=None, iface=None, nofilter=0, *args, **kargs):
+    """Send packets at layer 3 and yield the (stimulus, answer) couples as the
+answers come, with answer=None for the stimuli left unanswered. Only <window>
+stimuli wait for an answer at once, and the packets are generated as they are
+sent, so that big scans are streamed
+ex: for s,r in isr(IP(dst="10.0.0.0/16")/TCP(dport=(1,1024)), window=4096): ...
+nofilter: put 1 to avoid use of bpf filters
+window:   how many stimuli can wait for an answer at once (default: 1024)
+timeout:  how much time to wait for the answer of each stimulus (default: 2s)
+retry:    how many times to resend the stimuli left unanswered
+inter:    time to wait between two stimuli
+verbose:  set verbosity level
+multi:    whether to accept multiple answers for the same stimulus
+pps, mbps: rate limits of the sending, in packets per second and Mbit/s
+burst:    number of packets that can be sent back to back under the limits
+filter:   provide a BPF filter
+iface:    listen answers only on the given interface"""
+    s = conf.L3socket(filter=filter, iface=iface, nofilter=nofilter)
+    try:
+        for res in sndrcvwindow(s, x, *args, **kargs):
+            yield res
+    finally:
+        s.close()
+
+@conf.commands.register
+def isrp(x, iface=None, iface_hint=None, filter=None, nofilter=0, type=ETH_P_ALL, *args, **kargs):
+    """Send packets at layer 2 and yield the (stimulus, answer) couples as the
+answers come, with answer=None for the stimuli left unanswered (see isr())
+nofilter: put 1 to avoid use of bpf filters
+window:   how many stimuli can wait for an answer at once (default: 1024)
+timeout:  how much time to wait for the answer of each stimulus (default: 2s)
+retry:    how many times to resend the stimuli left unanswered
+inter:    time to wait between two stimuli
+verbose:  set verbosity level
+multi:    whether to accept multiple answers for the same stimulus
+pps, mbps: rate limits of the sending, in packets per second and Mbit/s
+burst:    number of packets that can be sent back to back under the limits
+filter:   provide a BPF filter
+iface:    work only on the given interface"""
+    if iface is None and iface_hint is not None:
+        iface = conf.route.route(iface_hint)[0]
+    s = conf.L2socket(iface=iface, filter=filter, nofilter=nofilter, type=type)
+    try:
+        for res in sndrcvwindow(s, x, *args, **kargs):
+            yield res
+    finally:
+        s.close()
+
 def __sr_loop(srfunc, pkts, prn=lambda x:x[1].summary(), prnfail=lambda x:x.summary(), inter=1, timeout=None, count=None, verbose=None, store=1, *args, **kargs):
     n = 0
     r = 0
@@ -530,7 +855,7 @@ iface:    listen answers only on the given interface"""
 
 @conf.commands.register
 def sniff(count=0, store=1, offline=None, prn = None, lfilter=None, L2socket=None, timeout=None,
-          opened_socket=None, stop_filter=None, *arg, **karg):
+          opened_socket=None, stop_filter=None, ring=None, pcap=None, *arg, **karg):
     """Sniff packets
 sniff([count=0,] [prn=None,] [store=1,] [offline=None,] [lfilter=None,] + L2ListenSocket args) -> list of packets
 
@@ -549,6 +874,9 @@ opened_socket: provide an object ready to use .recv() on
 stop_filter: python function applied to each packet to determine
              if we have to stop the capture after this packet
              ex: stop_filter = lambda x: x.haslayer(TCP)
+   ring: store only the last <ring> packets
+   pcap: pcap file name or PcapWriter (e.g. a rotating one, see
+         RawPcapWriter) to write the packets to
     """
     c = 0
     
@@ -562,39 +890,60 @@ stop_filter: python function applied to each packet to determine
         else:
             s = PcapReader(offline)
 
-    lst = []
+    if ring:
+        lst = collections.deque(maxlen=ring)
+    else:
+        lst = []
+    opened_pcap = type(pcap) is str
+    if opened_pcap:
+        pcap = PcapWriter(pcap)
     if timeout is not None:
         stoptime = time.time()+timeout
     remain = None
+    # recvmmsg(2), see L2Socket.recv_batch(). The frames of a batch after the
+    # one matching stop_filter would be lost for the caller's socket
+    batch = getattr(s, "batch_size", 1) > 1 and not (stop_filter and opened_socket is not None)
+    stop = False
     try:
-        while 1:
+        while not stop:
             if timeout is not None:
                 remain = stoptime-time.time()
                 if remain <= 0:
                     break
             sel = select([s],[],[],remain)
             if s in sel[0]:
-                p = s.recv(MTU)
-                if p is None:
-                    break
-                if lfilter and not lfilter(p):
-                    continue
-                if store:
-                    lst.append(p)
-                c += 1
-                if prn:
-                    r = prn(p)
-                    if r is not None:
-                        print r
-                if stop_filter and stop_filter(p):
-                    break
-                if count > 0 and c >= count:
-                    break
+                if batch:
+                    pkts = s.recv_batch(min(s.batch_size, count-c) if count > 0 else None)
+                else:
+                    p = s.recv(MTU)
+                    if p is None:
+                        break
+                    pkts = [p]
+                for p in pkts:
+                    if lfilter and not lfilter(p):
+                        continue
+                    if store:
+                        lst.append(p)
+                    if pcap is not None:
+                        pcap.write(p)
+                    c += 1
+                    if prn:
+                        r = prn(p)
+                        if r is not None:
+                            print r
+                    if (stop_filter and stop_filter(p)) or (count > 0 and c >= count):
+                        stop = True
+                        break
     except KeyboardInterrupt:
         pass
-    if opened_socket is None:
-        s.close()
-    return plist.PacketList(lst,"Sniffed")
+    finally:
+        if opened_socket is None:
+            s.close()
+        if opened_pcap:
+            pcap.close()
+        elif pcap is not None:
+            pcap.flush()
+    return plist.PacketList(list(lst),"Sniffed")
 
 
 @conf.commands.register
@@ -24,6 +24,7 @@ class SuperSocket:
     __metaclass__ = _SuperSocket_metaclass
     desc = None
     closed=0
+    batch_size = 1 # packets sent or received at once by the batch loops
     def __init__(self, family=socket.AF_INET,type=socket.SOCK_STREAM, proto=0):
         self.ins = socket.socket(family, type, proto)
         self.outs = self.ins
@@ -35,6 +36,25 @@ class SuperSocket:
         return self.outs.send(sx)
     def recv(self, x=MTU):
         return conf.raw_layer(self.ins.recv(x))
+    def send_batch(self, pkts):
+        """Sends the packets of pkts and returns the number of bytes sent.
+If a packet cannot be sent, the socket.error raised tells how many packets
+(.sent) and bytes (.nbytes) were sent before it"""
+        nbytes = 0
+        for i,x in enumerate(pkts):
+            try:
+                nbytes += self.send(x) or 0
+            except socket.error,msg:
+                msg.sent,msg.nbytes = i,nbytes
+                raise
+        return nbytes
+    def recv_batch(self, count=None, x=MTU):
+        """Returns the packets waiting on the socket, up to <count> (at
+least one, or none if it was dropped by recv())"""
+        p = self.recv(x)
+        if p is None:
+            return []
+        return [p]
     def fileno(self):
         return self.ins.fileno()
     def close(self):
@@ -97,9 +117,11 @@ class L3RawSocket(SuperSocket):
         return pkt
     def send(self, x):
         try:
+            if type(x) is str: # already built (see Packet.iter_raw())
+                return self.outs.sendto(x,(socket.inet_ntoa(x[16:20]),0))
             sx = str(x)
             x.sent_time = time.time()
-            self.outs.sendto(sx,(x.dst,0))
+            return self.outs.sendto(sx,(x.dst,0))
         except socket.error,msg:
             log_runtime.error(msg)
 
@@ -9,8 +9,8 @@ General utility functions.
 
 import os,sys,socket,types
 import random,time
-import gzip,zlib,cPickle
-import re,struct,array
+import gzip,zlib,cPickle,mmap
+import re,struct,array,itertools,bisect,heapq,collections
 import subprocess
 
 import warnings
@@ -19,7 +19,7 @@ warnings.filterwarnings("ignore","tempnam",RuntimeWarning, __name__)
 from config import conf
 from data import MTU
 from error import log_runtime,log_loading,log_interactive, Scapy_Exception
-from base_classes import BasePacketList
+from base_classes import BasePacketList,BasePacket
 
 WINDOWS=sys.platform.startswith("win32")
 
@@ -227,6 +227,11 @@ if struct.pack("H",1) == "\x00\x01": # big endian
         s += s >> 16
         s = ~s
         return s & 0xffff
+    def checksum_fold(s):
+        s = (s >> 16) + (s & 0xffff)
+        s += s >> 16
+        s = ~s
+        return s & 0xffff
 else:
     def checksum(pkt):
         if len(pkt) % 2 == 1:
@@ -236,7 +241,36 @@ else:
         s += s >> 16
         s = ~s
         return (((s>>8)&0xff)|s<<8) & 0xffff
+    def checksum_fold(s):
+        s = (s >> 16) + (s & 0xffff)
+        s += s >> 16
+        s = ~s
+        return (((s>>8)&0xff)|s<<8) & 0xffff
 
+def checksum_sum(pkt):
+    """Returns the sum of the 16 bits words of pkt, that checksum_fold() turns
+into its checksum. The sums of the parts of a string (of even lengths but
+for the last one) add up to the sum of the string."""
+    if len(pkt) % 2 == 1:
+        pkt += "\0"
+    return sum(array.array("H", pkt))
+
+def checksum_update(ck, old, new, odd=0):
+    """Returns the internet checksum ck of a string updated for the bytes old
+being replaced with new, of the same length (RFC 1624). odd tells whether
+they start at an odd offset of the checksummed data."""
+    if odd:
+        old = "\0"+old
+        new = "\0"+new
+    if len(old) % 2 == 1:
+        old += "\0"
+        new += "\0"
+    n = len(old)/2
+    # ~ck + ~old + new, ~m being 0xffff-m for each 16 bits word
+    s = (~ck & 0xffff) + 0xffff*n - sum(struct.unpack("!%iH" % n, old)) + sum(struct.unpack("!%iH" % n, new))
+    while s >> 16:
+        s = (s >> 16) + (s & 0xffff)
+    return ~s & 0xffff
 
 def _fletcher16(charbuf):
     # This is based on the GPLed C implementation in Zebra <http://www.zebra.org/>
@@ -480,6 +514,19 @@ def import_object(obj=None):
     return cPickle.loads(gzip.zlib.decompress(obj.strip().decode("base64")))
 
 
+def gzip_file(fname, compresslevel=9):
+    """Compresses a file into fname.gz and removes it"""
+    f = open(fname, "rb")
+    g = gzip.open(fname+".gz", "wb", compresslevel)
+    while True:
+        s = f.read(1<<20)
+        if not s:
+            break
+        g.write(s)
+    g.close()
+    f.close()
+    os.unlink(fname)
+
 def save_object(fname, obj):
     cPickle.dump(obj,gzip.open(fname,"wb"))
 
@@ -519,33 +566,285 @@ def corrupt_bits(s, p=0.01, n=None):
 def wrpcap(filename, pkt, *args, **kargs):
     """Write a list of packets to a pcap file
 gz: set to 1 to save a gzipped capture
+compresslevel: compression level of gzipped captures (1 to 9)
 linktype: force linktype value
-endianness: "<" or ">", force endianness"""
+endianness: "<" or ">", force endianness
+nano: write nanosecond timestamps
+pcapng: write a pcapng file (default for file names ending with .pcapng)"""
     PcapWriter(filename, *args, **kargs).write(pkt)
 
+def get_time_ns(pkt):
+    """Returns the time of pkt in nanoseconds: its exact capture timestamp
+when it has one and its time has not been changed since, else its time"""
+    t = pkt.time
+    ns = pkt.time_ns
+    if ns is not None and abs(ns*1e-9-t) < 1e-6:
+        return ns
+    sec = int(t)
+    return sec*1000000000+int(round((t-sec)*1000000000))
+
 @conf.commands.register
-def rdpcap(filename, count=-1):
-    """Read a pcap file and return a packet list
-count: read only <count> packets"""
+def rdpcap(filename, count=-1, workers=None):
+    """Read a pcap or pcapng file and return a packet list
+count: read only <count> packets
+workers: number of processes dissecting the packets"""
+    if workers > 1:
+        import plist
+        return plist.PacketList(list(irdpcap(filename, count, workers)),
+                                name=os.path.basename(filename))
     return PcapReader(filename).read_all(count=count)
 
+def _rdpcap_chunk(chunk):
+    """DEV: dissects <count> packets from a position of a capture file
+(in an irdpcap() worker)"""
+    filename,off,state,count = chunk
+    r = PcapReader(filename)
+    r.seek_offset(off, state)
+    res = list(itertools.islice(r, count))
+    r.close()
+    return res
+
+def irdpcap(filename, count=-1, workers=None):
+    """Yields the packets of a pcap or pcapng file, in order, as they are
+dissected by a pool of <workers> processes (default: one per CPU). The
+file is split at the records indexed by get_pcap_index()
+count: read only <count> packets"""
+    import multiprocessing
+    if not workers:
+        workers = multiprocessing.cpu_count()
+    idx = get_pcap_index(filename)
+    total = idx.count
+    if count >= 0:
+        total = min(total, count)
+    r = RawPcapReader(filename)
+    compressed = type(r.f) is not file
+    r.close()
+    # compressed chunks are decompressed from the start of the file
+    nchunks = compressed and workers or 4*workers
+    per = max(1, -(-total // (nchunks*idx.step)))*idx.step
+    chunks = []
+    for n in xrange(0, total, per):
+        i = n//idx.step
+        chunks.append((filename, idx.offsets[i], idx.states[idx.state_ids[i]],
+                       min(per, total-n)))
+    if not chunks:
+        return
+    pool = multiprocessing.Pool(min(workers, len(chunks)))
+    try:
+        for res in pool.imap(_rdpcap_chunk, chunks):
+            for p in res:
+                yield p
+        pool.close()
+    finally:
+        pool.terminate()
+
+
+
+COMPRESSION_MAGICS = [("\x1f\x8b", "gzip"),
+                      ("\x28\xb5\x2f\xfd", "zstd"),
+                      ("\x04\x22\x4d\x18", "lz4")]
+
+def compression_format(magic):
+    """Returns the compression format ("gzip", "zstd", "lz4") of a file
+starting with magic, or None"""
+    for m,fmt in COMPRESSION_MAGICS:
+        if magic.startswith(m):
+            return fmt
+    return None
+
+def _gzip_chunks(f, size):
+    """DEV: decompresses the members of a gzip file by chunks"""
+    d = zlib.decompressobj(16+zlib.MAX_WBITS)
+    while True:
+        s = f.read(size)
+        if not s:
+            break
+        while s:
+            out = d.decompress(s)
+            if out:
+                yield out
+            s = d.unused_data
+            if s: # next member
+                if not s.strip("\0"): # padding
+                    return
+                d = zlib.decompressobj(16+zlib.MAX_WBITS)
+    out = d.flush() # truncated file
+    if out:
+        yield out
+
+def _stream_chunks(d, f, size):
+    """DEV: decompresses a file by chunks with a decompressor object"""
+    while True:
+        s = f.read(size)
+        if not s:
+            break
+        out = d.decompress(s)
+        if out:
+            yield out
+
+def decompress_chunks(fmt, f, size):
+    """DEV: returns a generator of the decompressed chunks of the file f"""
+    if fmt == "gzip":
+        return _gzip_chunks(f, size)
+    elif fmt == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise Scapy_Exception("Reading zstd compressed files needs the zstandard module")
+        return _stream_chunks(zstandard.ZstdDecompressor().decompressobj(), f, size)
+    elif fmt == "lz4":
+        try:
+            import lz4.frame
+        except ImportError:
+            raise Scapy_Exception("Reading lz4 compressed files needs the lz4 module")
+        return _stream_chunks(lz4.frame.LZ4FrameDecompressor(), f, size)
+    raise Scapy_Exception("Unknown compression format %r" % fmt)
+
+class DecompressedFile:
+    """A read-only file object on a compressed file, decompressed ahead of
+the reads by a background thread into a bounded queue of chunks"""
+    chunksize = 1<<18   # compressed bytes read at once
+    maxchunks = 16      # decompressed chunks waiting for read()
+    def __init__(self, filename, fmt):
+        self.filename = filename
+        self.fmt = fmt
+        self.thread = None
+        self.start()
+
+    def start(self):
+        """DEV: (re)starts decompressing from the beginning of the file"""
+        import threading,Queue
+        self.stop()
+        self.raw = open(self.filename, "rb")
+        chunks = decompress_chunks(self.fmt, self.raw, self.chunksize)
+        self.queue = Queue.Queue(self.maxchunks)
+        self.stopped = threading.Event()
+        # the thread does not refer to self, for it to be stopped by __del__()
+        self.thread = threading.Thread(target=_decompress_thread, args=(chunks, self.queue, self.stopped))
+        self.thread.daemon = True
+        self.thread.start()
+        self.chunk = ""
+        self.coff = 0     # read offset in chunk
+        self.cpos = 0     # position of chunk in the decompressed stream
+        self.eof = False
+
+    def stop(self):
+        """DEV: stops the decompression thread"""
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+            self.raw.close()
+
+    def next_chunk(self):
+        """DEV: moves to the next decompressed chunk. Returns False at the
+end of the file"""
+        if self.eof:
+            return False
+        c = self.queue.get()
+        if isinstance(c, Exception):
+            self.eof = True
+            raise c
+        self.cpos += len(self.chunk)
+        self.chunk = c
+        self.coff = 0
+        if not c:
+            self.eof = True
+            return False
+        return True
+
+    def read(self, n=-1):
+        res = []
+        while n:
+            if self.coff >= len(self.chunk) and not self.next_chunk():
+                break
+            if n > 0:
+                s = self.chunk[self.coff:self.coff+n]
+                n -= len(s)
+            else:
+                s = self.chunk[self.coff:]
+            self.coff += len(s)
+            res.append(s)
+        return "".join(res)
+
+    def tell(self):
+        return self.cpos+self.coff
+
+    def seek(self, off, whence=0):
+        if whence == 1:
+            off += self.tell()
+        elif whence == 2:
+            raise IOError("Seeking from the end of a compressed file is not supported")
+        if off < self.cpos:
+            self.start()
+        if off <= self.cpos+len(self.chunk):
+            self.coff = off-self.cpos
+        else:
+            while off > self.cpos+len(self.chunk) and self.next_chunk():
+                pass
+            self.coff = min(off-self.cpos, len(self.chunk))
+
+    def fileno(self):
+        return self.raw.fileno()
+
+    def close(self):
+        self.stop()
+
+    def __del__(self):
+        if self.thread is not None:
+            self.stopped.set()
+
+def _decompress_thread(chunks, queue, stopped):
+    """DEV: body of the DecompressedFile threads: queues the decompressed
+chunks, then "" at the end of the file, or the exception that was raised"""
+    import Queue
+    def put(c):
+        while not stopped.is_set():
+            try:
+                queue.put(c, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+    try:
+        for c in chunks:
+            if not put(c):
+                return
+        put("")
+    except Exception,e:
+        put(e)
 
 
 class RawPcapReader:
-    """A stateful pcap reader. Each packet is returned as a string"""
+    """A stateful pcap (or pcapng) reader. Each packet is returned as a string"""
 
+    mm = None
+    ng = 0
+    nano = 0
+    comment = None
+    index = None
     def __init__(self, filename):
         self.filename = filename
-        try:
-            self.f = gzip.open(filename,"rb")
-            magic = self.f.read(4)
-        except IOError:
-            self.f = open(filename,"rb")
+        self.f = open(filename,"rb")
+        magic = self.f.read(4)
+        fmt = compression_format(magic)
+        if fmt is not None:
+            self.f.close()
+            self.f = DecompressedFile(filename, fmt)
             magic = self.f.read(4)
         if magic == "\xa1\xb2\xc3\xd4": #big endian
             self.endian = ">"
         elif  magic == "\xd4\xc3\xb2\xa1": #little endian
             self.endian = "<"
+        elif magic == "\xa1\xb2\x3c\x4d": #big endian, nanosecond timestamps
+            self.endian = ">"
+            self.nano = 1
+        elif magic == "\x4d\x3c\xb2\xa1": #little endian, nanosecond timestamps
+            self.endian = "<"
+            self.nano = 1
+        elif magic == "\x0a\x0d\x0d\x0a": # pcapng section header block
+            self.open_ng()
+            return
         else:
             raise Scapy_Exception("Not a pcap capture file (bad magic)")
         hdr = self.f.read(20)
@@ -554,10 +853,150 @@ class RawPcapReader:
         vermaj,vermin,tz,sig,snaplen,linktype = struct.unpack(self.endian+"HHIIII",hdr)
 
         self.linktype = linktype
-
+        self.rechdr = struct.Struct(self.endian+"IIII")
+        if type(self.f) is file:
+            self.map_file()
+
+    def open_ng(self):
+        """DEV: reads the pcapng blocks up to the first interface description,
+which gives the link type of the capture"""
+        self.ng = 1
+        self.interfaces = []
+        self.names = {}
+        self.linktype = 1
+        self.f.seek(0)
+        while not self.interfaces:
+            blk = self.read_ng_block()
+            if blk is None:
+                break
+            if blk[0] in (2,3,6):
+                raise Scapy_Exception("Invalid pcapng file (packet before any interface description)")
+        if self.interfaces:
+            self.linktype = self.interfaces[0][0]
+
+    def ng_options(self, s):
+        """DEV: returns the options of a pcapng block as a list of (code,value)"""
+        opts = []
+        off = 0
+        while off+4 <= len(s):
+            code,l = struct.unpack(self.endian+"HH", s[off:off+4])
+            if code == 0: # opt_endofopt
+                break
+            opts.append((code, s[off+4:off+4+l]))
+            off += 4+l+(-l%4)
+        return opts
+
+    def read_ng_block(self):
+        """DEV: reads the next pcapng block and keeps track of the sections,
+interfaces and name resolution records. Returns (type,body) or None at the
+end of the file"""
+        hdr = self.f.read(8)
+        if len(hdr) < 8:
+            return None
+        if hdr[:4] == "\x0a\x0d\x0d\x0a": # new section: the byte order may change
+            bom = self.f.read(4)
+            if bom == "\x1a\x2b\x3c\x4d":
+                self.endian = ">"
+            elif bom == "\x4d\x3c\x2b\x1a":
+                self.endian = "<"
+            else:
+                raise Scapy_Exception("Invalid pcapng file (bad byte-order magic)")
+            hdr += bom
+        btype,blen = struct.unpack(self.endian+"II", hdr[:8])
+        if blen < len(hdr)+4 or blen % 4:
+            raise Scapy_Exception("Invalid pcapng file (bad block length)")
+        body = self.f.read(blen-len(hdr))
+        if len(body) < blen-len(hdr):
+            return None
+        body = hdr[8:]+body[:-4]
+        if btype == 0x0a0d0d0a: # section header block
+            vermaj, = struct.unpack(self.endian+"H", body[4:6])
+            if vermaj != 1:
+                raise Scapy_Exception("Unsupported pcapng version %i" % vermaj)
+            self.interfaces = []
+        elif btype == 1: # interface description block
+            linktype,_,snaplen = struct.unpack(self.endian+"HHI", body[:8])
+            units = 1000000
+            tsoffset = 0
+            for code,val in self.ng_options(body[8:]):
+                if code == 9: # if_tsresol
+                    v = ord(val[0])
+                    units = v & 0x80 and 2**(v & 0x7f) or 10**v
+                elif code == 14: # if_tsoffset
+                    tsoffset, = struct.unpack(self.endian+"q", val[:8])
+            self.interfaces.append((linktype,snaplen,units,tsoffset))
+        elif btype == 4: # name resolution block
+            off = 0
+            while off+4 <= len(body):
+                rtype,l = struct.unpack(self.endian+"HH", body[off:off+4])
+                val = body[off+4:off+4+l]
+                off += 4+l+(-l%4)
+                if rtype == 1: # nrb_record_ipv4
+                    self.names[inet_ntoa(val[:4])] = val[4:].split("\0")[0]
+                elif rtype == 2: # nrb_record_ipv6
+                    self.names[inet_ntop(socket.AF_INET6, val[:16])] = val[16:].split("\0")[0]
+                elif rtype == 0: # nrb_record_end
+                    break
+        return btype,body
+
+    def read_ng_packet(self):
+        """DEV: read_packet_ns() for pcapng files. Sets the link type of the
+interface the packet was captured on, its comment, if any, and nano when
+the resolution of its timestamp is finer than the microsecond"""
+        while True:
+            blk = self.read_ng_block()
+            if blk is None:
+                return None
+            btype,body = blk
+            if btype == 6: # enhanced packet block
+                ifid,tshigh,tslow,caplen,wirelen = struct.unpack(self.endian+"IIIII", body[:20])
+                s = body[20:20+caplen]
+                opts = body[20+caplen+(-caplen%4):]
+            elif btype == 3: # simple packet block: no timestamp
+                ifid = 0
+                wirelen, = struct.unpack(self.endian+"I", body[:4])
+                s = body[4:4+wirelen]
+                opts = ""
+            elif btype == 2: # packet block (obsolete)
+                ifid,drops,tshigh,tslow,caplen,wirelen = struct.unpack(self.endian+"HHIIII", body[:20])
+                s = body[20:20+caplen]
+                opts = body[20+caplen+(-caplen%4):]
+            else:
+                continue
+            if ifid >= len(self.interfaces):
+                raise Scapy_Exception("Invalid pcapng file (unknown interface %i)" % ifid)
+            linktype,snaplen,units,tsoffset = self.interfaces[ifid]
+            if btype == 3:
+                if snaplen:
+                    s = s[:snaplen]
+                sec = nsec = 0
+            else:
+                sec,frac = divmod((tshigh << 32) | tslow, units)
+                sec += tsoffset
+                # nanoseconds, which is as precise as time_ns can be
+                nsec = frac*1000000000//units
+            self.nano = btype != 3 and units != 1000000
+            self.linktype = linktype
+            self.comment = None
+            for code,val in self.ng_options(opts):
+                if code == 1: # opt_comment
+                    self.comment = val
+            return s[:MTU],(sec,nsec,wirelen)
+
+    def map_file(self):
+        """Maps the (uncompressed) capture file in memory, for read_packet()
+to walk the records without reading them one by one from the file"""
+        try:
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError, mmap.error): # empty file, pipe...
+            self.mm = None
+            return
+        self.off = self.f.tell()
 
 
     def __iter__(self):
+        if self.mm is not None and self.read_packet.im_func is RawPcapReader.read_packet.im_func:
+            return self.iter_mapped()
         return self
 
     def next(self):
@@ -567,19 +1006,161 @@ class RawPcapReader:
             raise StopIteration
         return pkt
 
+    def iter_mapped(self):
+        """DEV: yields the records of the mapped file like read_packet()"""
+        mm = self.mm
+        unpack_from = self.rechdr.unpack_from
+        div = self.nano and 1000 or 1
+        end = len(mm)
+        off = self.off
+        while off+16 <= end:
+            sec,usec,caplen,wirelen = unpack_from(mm, off)
+            if off+16+caplen > end:
+                break
+            self.off = off+16+caplen
+            yield mm[off+16:off+16+min(caplen,MTU)],(sec,usec//div,wirelen)
+            if self.mm is not mm: # read_packet() has been called meanwhile
+                break
+            off = self.off
+        while True:
+            pkt = self.read_packet()
+            if pkt is None:
+                return
+            yield pkt
+
 
     def read_packet(self, size=MTU):
-        """return a single packet read from the file
+        """return a single packet read from the file as (s,(sec,usec,wirelen))
+        
+        returns None when no more packets are available
+        """
+        rp = RawPcapReader.read_packet_ns(self, size)
+        if rp is None:
+            return None
+        s,(sec,nsec,wirelen) = rp
+        return s,(sec,nsec//1000,wirelen)
+
+    def read_packet_ns(self, size=MTU):
+        """return a single packet read from the file as (s,(sec,nsec,wirelen)),
+        the fraction of second of its timestamp being in nanoseconds
         
         returns None when no more packets are available
         """
+        if self.ng:
+            return self.read_ng_packet()
+        mul = self.nano and 1 or 1000
+        mm = self.mm
+        if mm is not None:
+            off = self.off
+            if off+16 <= len(mm):
+                sec,usec,caplen,wirelen = self.rechdr.unpack_from(mm, off)
+                off += 16
+                if off+caplen <= len(mm):
+                    self.off = off+caplen
+                    return mm[off:off+min(caplen,MTU)],(sec,usec*mul,wirelen)
+            # end of the mapped file: read what may have been appended since
+            self.mm = None
+            mm.close()
+            self.f.seek(self.off)
         hdr = self.f.read(16)
         if len(hdr) < 16:
             return None
-        sec,usec,caplen,wirelen = struct.unpack(self.endian+"IIII", hdr)
+        sec,usec,caplen,wirelen = self.rechdr.unpack(hdr)
         s = self.f.read(caplen)[:MTU]
-        return s,(sec,usec,wirelen) # caplen = len(s)
+        return s,(sec,usec*mul,wirelen) # caplen = len(s)
+
+
+    def make_packet(self, rp):
+        """DEV: turns a record returned by read_packet_ns() into what the
+reader returns (see PcapReader)"""
+        s,(sec,nsec,wirelen) = rp
+        return s,(sec,nsec//1000,wirelen)
+
+    def record_time(self, rp):
+        """DEV: time of a record returned by read_packet_ns()"""
+        s,(sec,nsec,wirelen) = rp
+        return sec+0.000000001*nsec
+
+    def tell(self):
+        """DEV: position of the next record, to be given to seek_offset()
+along with the pcapng state"""
+        if self.mm is not None:
+            return self.off
+        return self.f.tell()
+
+    def ng_state(self):
+        """DEV: what seek_offset() needs to read pcapng blocks from a position"""
+        if self.ng:
+            return self.endian,tuple(self.interfaces)
+        return None
+
+    def seek_offset(self, off, state=None):
+        """DEV: moves to a position returned by tell()"""
+        if state is not None:
+            self.endian,interfaces = state
+            self.interfaces = list(interfaces)
+        if self.mm is not None:
+            self.off = off
+        else:
+            self.f.seek(off)
+            if not self.ng and type(self.f) is file:
+                self.map_file()
+
+    def get_index(self):
+        """returns the index of the capture (see get_pcap_index())"""
+        if self.index is None:
+            self.index = get_pcap_index(self.filename)
+        return self.index
+
+    def seek(self, n):
+        """moves to the n-th record (counting from 0) of the capture,
+using its index"""
+        idx = self.get_index()
+        if n < 0:
+            n += idx.count
+        if not 0 <= n <= idx.count:
+            raise IndexError("record %i out of range" % n)
+        i = min(n//idx.step, len(idx.offsets)-1)
+        if i < 0: # empty capture
+            return
+        self.seek_offset(idx.offsets[i], idx.states[idx.state_ids[i]])
+        for k in xrange(n-i*idx.step):
+            RawPcapReader.read_packet_ns(self)
+
+    def __getitem__(self, item):
+        if type(item) is slice:
+            start,stop,step = item.indices(self.get_index().count)
+            self.seek(start)
+            res = self.read_all(max(stop-start,0))
+            if step != 1:
+                res = res[::step]
+            return res
+        self.seek(item)
+        p = self.read_packet()
+        if p is None:
+            raise IndexError("record %i out of range" % item)
+        return p
 
+    def between(self, t0, t1):
+        """yields the packets captured from t0 (included) to t1 (excluded).
+The records of the capture are expected to be in chronological order"""
+        for rp in self.records_between(t0, t1):
+            yield self.make_packet(rp)
+
+    def records_between(self, t0, t1):
+        """DEV: between() on the records returned by read_packet_ns()"""
+        idx = self.get_index()
+        i = bisect.bisect_left(idx.times, t0)-1
+        self.seek(max(i,0)*idx.step)
+        while True:
+            rp = RawPcapReader.read_packet_ns(self)
+            if rp is None:
+                return
+            t = self.record_time(rp)
+            if t >= t1:
+                return
+            if t >= t0:
+                yield rp
 
     def dispatch(self, callback):
         """call the specified callback routine for each packet read
@@ -594,14 +1175,9 @@ class RawPcapReader:
     def read_all(self,count=-1):
         """return a list of all packets in the pcap file
         """
-        res=[]
-        while count != 0:
-            count -= 1
-            p = self.read_packet()
-            if p is None:
-                break
-            res.append(p)
-        return res
+        if count < 0:
+            return list(self)
+        return list(itertools.islice(self, count))
 
     def recv(self, size=MTU):
         """ Emulate a socket
@@ -612,6 +1188,9 @@ class RawPcapReader:
         return self.f.fileno()
 
     def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
         return self.f.close()
 
     def __enter__(self):
@@ -624,16 +1203,24 @@ class RawPcapReader:
 class PcapReader(RawPcapReader):
     def __init__(self, filename):
         RawPcapReader.__init__(self, filename)
+        self.LLtype = self.linktype
+        self.LLcls = self.get_LLcls(self.linktype)
+    def get_LLcls(self, linktype):
         try:
-            self.LLcls = conf.l2types[self.linktype]
+            return conf.l2types[linktype]
         except KeyError:
-            warning("PcapReader: unknown LL type [%i]/[%#x]. Using Raw packets" % (self.linktype,self.linktype))
-            self.LLcls = conf.raw_layer
+            warning("PcapReader: unknown LL type [%i]/[%#x]. Using Raw packets" % (linktype,linktype))
+            return conf.raw_layer
     def read_packet(self, size=MTU):
-        rp = RawPcapReader.read_packet(self,size)
+        rp = RawPcapReader.read_packet_ns(self,size)
         if rp is None:
             return None
-        s,(sec,usec,wirelen) = rp
+        return self.make_packet(rp)
+    def make_packet(self, rp):
+        s,(sec,nsec,wirelen) = rp
+        if self.linktype != self.LLtype: # pcapng interfaces may differ
+            self.LLtype = self.linktype
+            self.LLcls = self.get_LLcls(self.linktype)
         
         try:
             p = self.LLcls(s)
@@ -643,7 +1230,10 @@ class PcapReader(RawPcapReader):
             if conf.debug_dissector:
                 raise
             p = conf.raw_layer(s)
-        p.time = sec+0.000001*usec
+        p.__dict__["time"] = sec+0.000000001*nsec
+        p.__dict__["time_ns"] = sec*1000000000+nsec
+        if self.comment is not None:
+            p.__dict__["comment"] = self.comment
         return p
     def read_all(self,count=-1):
         res = RawPcapReader.read_all(self, count)
@@ -654,9 +1244,248 @@ class PcapReader(RawPcapReader):
         
 
 
+PCAP_INDEX_MAGIC = "SCPYPIDX"
+PCAP_INDEX_VERSION = 1
+
+class PcapIndex(object):
+    """Offsets and timestamps of every <step>th record of a capture file, to
+seek in it without reading it from the start. See get_pcap_index()"""
+    def __init__(self, filename, step=1024):
+        self.filename = filename
+        self.step = step
+        st = os.stat(filename)
+        self.size,self.mtime = st.st_size,st.st_mtime
+        self.offsets = []
+        self.times = []
+        self.state_ids = []
+        self.states = [] # pcapng states (byte order and interfaces)
+        r = RawPcapReader(filename)
+        n = 0
+        pos,state = r.tell(),r.ng_state()
+        for rp in iter(r.read_packet_ns, None):
+            if n % step == 0:
+                if not self.states or self.states[-1] != state:
+                    self.states.append(state)
+                self.offsets.append(pos)
+                self.times.append(r.record_time(rp))
+                self.state_ids.append(len(self.states)-1)
+            n += 1
+            if n % step == 0:
+                pos,state = r.tell(),r.ng_state()
+        r.close()
+        self.count = n
+
+    def is_fresh(self):
+        """tells whether the capture file has not changed since the index was built"""
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return False
+        return (st.st_size,st.st_mtime) == (self.size,self.mtime)
+
+    def save(self, fname=None):
+        """saves the index, by default next to the capture file (.idx)"""
+        f = open(fname or self.filename+".idx", "wb")
+        f.write(PCAP_INDEX_MAGIC+struct.pack("!BQdIQII", PCAP_INDEX_VERSION, self.size,
+                                             self.mtime, self.step, self.count,
+                                             len(self.offsets), len(self.states)))
+        f.write("".join(struct.pack("!QdI", *e) for e in
+                        zip(self.offsets, self.times, self.state_ids)))
+        for state in self.states:
+            if state is None: # pcap file
+                f.write("\0")
+                continue
+            endian,interfaces = state
+            f.write(struct.pack("!cH", endian, len(interfaces)))
+            for linktype,snaplen,units,tsoffset in interfaces:
+                # units may be up to 2**127 (if_tsresol)
+                units = "%i" % units
+                f.write(struct.pack("!HIqB", linktype, snaplen, tsoffset, len(units))+units)
+        f.close()
+
+def load_pcap_index(filename, fname=None):
+    """Loads the index of a capture file saved by PcapIndex.save() (by
+default in the .idx file next to it). Returns None if the index is missing,
+invalid or out of date"""
+    try:
+        s = open(fname or filename+".idx", "rb").read()
+    except IOError:
+        return None
+    hdr = struct.Struct("!BQdIQII")
+    off = len(PCAP_INDEX_MAGIC)+hdr.size
+    if len(s) < off or not s.startswith(PCAP_INDEX_MAGIC):
+        return None
+    version,size,mtime,step,count,n,m = hdr.unpack_from(s, len(PCAP_INDEX_MAGIC))
+    if version != PCAP_INDEX_VERSION or not step:
+        return None
+    idx = PcapIndex.__new__(PcapIndex) # not built from the file
+    idx.filename,idx.step,idx.count = filename,step,count
+    idx.size,idx.mtime = size,mtime
+    if not idx.is_fresh():
+        return None
+    entry = struct.Struct("!QdI")
+    try:
+        entries = [ entry.unpack_from(s, off+i*entry.size) for i in xrange(n) ]
+        off += n*entry.size
+        idx.states = []
+        for i in xrange(m):
+            if s[off] == "\0":
+                idx.states.append(None)
+                off += 1
+                continue
+            endian,nif = struct.unpack_from("!cH", s, off)
+            if endian not in ("<", ">"):
+                return None
+            off += 3
+            interfaces = []
+            for j in xrange(nif):
+                linktype,snaplen,tsoffset,l = struct.unpack_from("!HIqB", s, off)
+                off += 15
+                interfaces.append((linktype,snaplen,int(s[off:off+l]),tsoffset))
+                off += l
+            idx.states.append((endian,tuple(interfaces)))
+    except (struct.error, IndexError, ValueError): # truncated
+        return None
+    idx.offsets = [ e[0] for e in entries ]
+    idx.times = [ e[1] for e in entries ]
+    idx.state_ids = [ e[2] for e in entries ]
+    if [ i for i in idx.state_ids if i >= m ]:
+        return None
+    return idx
+
+
+@conf.commands.register
+def get_pcap_index(filename, step=None, save=False):
+    """Returns the index of a capture file (see PcapIndex): the one saved
+next to it (.idx), if it is up to date, or else a new one
+step: a record out of <step> is indexed (default: that of the saved
+      index, or 1024)
+save: save the new index next to the capture file"""
+    idx = load_pcap_index(filename)
+    if idx is None or step not in (None, idx.step):
+        idx = PcapIndex(filename, step or 1024)
+        if save:
+            idx.save()
+    return idx
+
+
+class PcapSequence:
+    """A read-only sequence of the packets of a capture file, dissected when
+they are accessed. Only the index of the capture (see PcapIndex) and the
+<cache_size> packets last accessed by position are kept in memory
+numbers: record numbers of the packets of the sequence (default: all)"""
+    cache_size = 256
+    reader = None
+    pos = None
+    def __init__(self, filename, numbers=None, cache_size=None, index=None, cache=None):
+        self.filename = filename
+        if index is None:
+            index = get_pcap_index(filename)
+        self.index = index
+        self.numbers = numbers
+        if cache_size is not None:
+            self.cache_size = cache_size
+        if cache is None:
+            cache = collections.OrderedDict()
+        self.cache = cache # record number -> packet, shared by the views
+
+    def select(self, numbers):
+        """returns the sequence of the packets at the given record numbers,
+sharing the index and the cache of this one"""
+        return self.__class__(self.filename, numbers, self.cache_size,
+                              self.index, self.cache)
+
+    def records(self):
+        """yields the record numbers of the packets of the sequence"""
+        if self.numbers is None:
+            return iter(xrange(self.index.count))
+        return iter(self.numbers)
+
+    def open_reader(self):
+        """DEV: a reader on the capture, seeking with the index of the sequence"""
+        r = PcapReader(self.filename)
+        r.index = self.index
+        return r
+
+    def move(self, r, pos, n):
+        """DEV: moves the reader r from record <pos> to record <n>. Records
+closer than an index step ahead are skipped without being dissected"""
+        if pos is not None and pos <= n < pos+self.index.step:
+            for k in xrange(n-pos):
+                RawPcapReader.read_packet(r)
+        else:
+            r.seek(n)
+
+    def __len__(self):
+        if self.numbers is None:
+            return self.index.count
+        return len(self.numbers)
+
+    def __iter__(self):
+        r = self.open_reader()
+        try:
+            if self.numbers is None:
+                for p in itertools.islice(r, self.index.count):
+                    yield p
+                return
+            pos = None
+            for n in self.numbers:
+                self.move(r, pos, n)
+                p = r.read_packet()
+                if p is None:
+                    return
+                pos = n+1
+                yield p
+        finally:
+            r.close()
+
+    def __getitem__(self, item):
+        if type(item) is slice:
+            sl = xrange(*item.indices(len(self)))
+            if self.numbers is None:
+                return self.select(sl)
+            return self.select(array.array("l", (self.numbers[i] for i in sl)))
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("packet %i out of range" % item)
+        n = item if self.numbers is None else self.numbers[item]
+        cache = self.cache
+        p = cache.pop(n, None)
+        if p is None:
+            if self.reader is None:
+                self.reader = self.open_reader()
+            self.move(self.reader, self.pos, n)
+            p = self.reader.read_packet()
+            if p is None:
+                self.pos = None
+                raise IndexError("record %i out of range" % n)
+            self.pos = n+1
+            while len(cache) >= self.cache_size:
+                cache.popitem(last=False)
+        cache[n] = p
+        return p
+
+    def __getslice__(self, i, j):
+        return self.__getitem__(slice(i,j))
+
+    def __repr__(self):
+        return "<PcapSequence %s: %i packets>" % (self.filename, len(self))
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+            self.pos = None
+
+
 class RawPcapWriter:
     """A stream PCAP writer with more control than wrpcap()"""
-    def __init__(self, filename, linktype=None, gz=False, endianness="", append=False, sync=False):
+    batch_size = 65536 # bytes of records packed before being written by write()
+    rotated = None
+    def __init__(self, filename, linktype=None, gz=False, endianness="", append=False, sync=False, pcapng=None, nano=False,
+                 bufsz=4096, compresslevel=9, rotate_size=None, rotate_count=None, rotate_time=None,
+                 keep=None, compress_rotated=False):
         """
         linktype: force linktype to a given value. If None, linktype is taken
                   from the first writter packet
@@ -664,8 +1493,28 @@ class RawPcapWriter:
         endianness: force an endianness (little:"<", big:">"). Default is native
         append: append packets to the capture file instead of truncating it
         sync: do not bufferize writes to the capture file
+        pcapng: write a pcapng capture. Default is to do so when filename
+                ends with .pcapng (or .pcapng.gz)
+        nano: write nanosecond timestamps. When appending to a pcap file, the
+              resolution of the file is used
+        bufsz: size of the buffer of the capture file
+        compresslevel: compression level (1 to 9) of gz captures
+        rotate_size: start a new file when the capture reaches this size (bytes,
+                     compressed for gz captures, give or take what the
+                     compressor buffers)
+        rotate_count: start a new file every rotate_count packets
+        rotate_time: start a new file every rotate_time seconds
+                     The previous files are renamed with a sequence number
+                     (capture.pcap -> capture.1.pcap, capture.2.pcap...)
+        keep: keep only the last <keep> previous files
+        compress_rotated: gzip the previous files (in the background)
         """
         
+        if pcapng is None:
+            pcapng = filename.endswith(".pcapng") or filename.endswith(".pcapng.gz")
+        self.pcapng = pcapng
+        self.interfaces = {} # pcapng interface ids, by link type
+        self.nano = nano
         self.linktype = linktype
         self.header_present = 0
         self.append=append
@@ -673,11 +1522,87 @@ class RawPcapWriter:
         self.endian = endianness
         self.filename=filename
         self.sync=sync
-        bufsz=4096
         if sync:
             bufsz=0
-
-        self.f = [open,gzip.open][gz](filename,append and "ab" or "wb", gz and 9 or bufsz)
+        self.rechdr = struct.Struct(self.endian+"IIII")
+        self.bufsz = bufsz
+        self.compresslevel = compresslevel
+        self.rotate_size = rotate_size
+        self.rotate_count = rotate_count
+        self.rotate_time = rotate_time
+        if rotate_size or rotate_count or rotate_time:
+            self.rotated = []
+            self.keep = keep
+            self.compress_rotated = compress_rotated
+            self.compressing = {} # gzip threads, by rotated file name
+            self.seq = 0
+        self.open_file()
+
+    def open_file(self):
+        """DEV: opens the capture file (again, when rotating it)"""
+        mode = self.append and "ab" or "wb"
+        if self.gz:
+            self.f = gzip.open(self.filename, mode, self.compresslevel)
+        else:
+            self.f = open(self.filename, mode, self.bufsz)
+        self.nrecords = 0
+        self.nbytes = 0
+        self.opened = time.time()
+
+    def rotation_due(self):
+        """DEV: tells whether the capture file has to be rotated before
+writing the next record"""
+        if not self.nrecords:
+            return False
+        return ((self.rotate_count and self.nrecords >= self.rotate_count) or
+                (self.rotate_size and self.file_size() >= self.rotate_size) or
+                (self.rotate_time and time.time()-self.opened >= self.rotate_time))
+
+    def file_size(self):
+        """DEV: size of the capture file written so far. For gz captures,
+that of the compressed data handed to the file, which lags behind what
+the compressor still buffers (a few tens of kB at most)"""
+        if self.gz:
+            return self.f.fileobj.tell()
+        return self.nbytes
+
+    def rotate(self):
+        """closes the current capture file, renames it with the next sequence
+number and starts a new one"""
+        self.f.close()
+        self.seq += 1
+        root = self.filename
+        ext = ""
+        if root.endswith(".gz"):
+            root,ext = root[:-3],".gz"
+        root,ext2 = os.path.splitext(root)
+        name = "%s.%i%s%s" % (root, self.seq, ext2, ext)
+        os.rename(self.filename, name)
+        for n,t in self.compressing.items():
+            if not t.isAlive():
+                del self.compressing[n]
+        if self.compress_rotated and not self.gz:
+            import threading
+            t = threading.Thread(target=gzip_file, args=(name, self.compresslevel))
+            t.start()
+            self.compressing[name] = t
+        self.rotated.append(name)
+        if self.keep is not None:
+            while len(self.rotated) > self.keep:
+                old = self.rotated.pop(0)
+                t = self.compressing.pop(old, None)
+                if t is not None: # do not remove a file being compressed
+                    t.join()
+                for f in [old, old+".gz"]:
+                    try:
+                        os.unlink(f)
+                    except OSError:
+                        pass
+        self.append = False
+        self.header_present = 0
+        self.interfaces = {}
+        self.open_file()
+        self._write_header(None)
         
     def fileno(self):
         return self.f.fileno()
@@ -685,16 +1610,25 @@ class RawPcapWriter:
     def _write_header(self, pkt):
         self.header_present=1
 
+        if self.pcapng:
+            # appended packets go to a new section, with its own interfaces
+            self.f.write(struct.pack(self.endian+"IIIHHqI", 0x0a0d0d0a, 28,
+                                     0x1a2b3c4d, 1, 0, -1, 28))
+            self.f.flush()
+            return
+
         if self.append:
             # Even if prone to race conditions, this seems to be
             # safest way to tell whether the header is already present
             # because we have to handle compressed streams that
             # are not as flexible as basic files
             g = [open,gzip.open][self.gz](self.filename,"rb")
-            if g.read(16):
+            hdr = g.read(16)
+            if hdr:
+                self.nano = hdr[:4] in ("\xa1\xb2\x3c\x4d", "\x4d\x3c\xb2\xa1")
                 return
             
-        self.f.write(struct.pack(self.endian+"IHHIIII", 0xa1b2c3d4L,
+        self.f.write(struct.pack(self.endian+"IHHIIII", self.nano and 0xa1b23c4dL or 0xa1b2c3d4L,
                                  2, 4, 0, 0, MTU, self.linktype))
         self.f.flush()
     
@@ -709,12 +1643,89 @@ class RawPcapWriter:
         if type(pkt) is str:
             self._write_packet(pkt)
         else:
-            for p in pkt:
+            self._write_packets(pkt)
+
+    def _write_packets(self, pkts):
+        """DEV: writes the records of a list of packets by batches"""
+        if self.rotated is not None: # the file may change at any packet
+            for p in pkts:
                 self._write_packet(p)
+            return
+        # the packets that do not have a time (strings) are stamped by
+        # _pack_record() as they are packed, not once per batch
+        self._write_batches(self._pack_packet(p) for p in pkts)
+
+    def write_records(self, records):
+        """writes raw records, as returned by RawPcapReader.read_packet():
+(s,(sec,usec,wirelen)), possibly followed by the link type and the comment
+of the packet (pcapng)"""
+        if not self.header_present: # sets nano when appending
+            self._write_header(None)
+        mul = self.nano and 1000 or 1
+        self._write_records((r[0], (r[1][0], r[1][1]*mul, r[1][2]))+tuple(r[2:])
+                            for r in records)
+
+    def write_records_ns(self, records):
+        """write_records() for the records returned by
+RawPcapReader.read_packet_ns(): (s,(sec,nsec,wirelen))..."""
+        if not self.header_present:
+            self._write_header(None)
+        div = self.nano and 1 or 1000
+        self._write_records((r[0], (r[1][0], r[1][1]//div, r[1][2]))+tuple(r[2:])
+                            for r in records)
+
+    def _write_records(self, records):
+        """DEV: write_records() with the fractions of second in the unit of
+the file (nanoseconds in nano mode, else microseconds)"""
+        if self.rotated is not None:
+            for r in records:
+                s,(sec,usec,wirelen) = r[:2]
+                RawPcapWriter._write_packet(self, s, sec, usec, len(s), wirelen, *r[2:])
+            return
+        pack = self._pack_record
+        self._write_batches(pack(r[0], r[1][0], r[1][1], len(r[0]), r[1][2], *r[2:])
+                            for r in records)
+
+    def _write_batches(self, records):
+        """DEV: writes packed records by batches of batch_size bytes"""
+        batch = []
+        sz = 0
+        for r in records:
+            batch.append(r)
+            sz += len(r)
+            if sz >= self.batch_size:
+                self.f.write("".join(batch))
+                self.nrecords += len(batch)
+                self.nbytes += sz
+                batch = []
+                sz = 0
+        self.f.write("".join(batch))
+        self.nrecords += len(batch)
+        self.nbytes += sz
+        if self.gz and self.sync:
+            self.f.flush()
+
+    def _pack_packet(self, packet):
+        """DEV: returns the record of a packet, stamped with the current time"""
+        return self._pack_record(packet)
 
-    def _write_packet(self, packet, sec=None, usec=None, caplen=None, wirelen=None):
+    def _write_packet(self, packet, sec=None, usec=None, caplen=None, wirelen=None, linktype=None, comment=None):
         """writes a single packet to the pcap file
+
+        usec is in nanoseconds when the writer is in nano mode
+        linktype and comment are only written to pcapng files
         """
+        if self.rotated is not None and self.rotation_due():
+            self.rotate()
+        r = self._pack_record(packet, sec, usec, caplen, wirelen, linktype, comment)
+        self.f.write(r)
+        self.nrecords += 1
+        self.nbytes += len(r)
+        if self.gz and self.sync:
+            self.f.flush()
+
+    def _pack_record(self, packet, sec=None, usec=None, caplen=None, wirelen=None, linktype=None, comment=None):
+        """DEV: returns the record written by _write_packet()"""
         if caplen is None:
             caplen = len(packet)
         if wirelen is None:
@@ -725,17 +1736,46 @@ class RawPcapWriter:
             if sec is None:
                 sec = it
             if usec is None:
-                usec = int(round((t-it)*1000000))
-        self.f.write(struct.pack(self.endian+"IIII", sec, usec, caplen, wirelen))
-        self.f.write(packet)
-        if self.gz and self.sync:
-            self.f.flush()
+                usec = int(round((t-it)*(self.nano and 1000000000 or 1000000)))
+        if self.pcapng:
+            return self._pack_ng_record(packet, sec, usec, caplen, wirelen, linktype, comment)
+        return self.rechdr.pack(sec, usec, caplen, wirelen)+packet
+
+    def _pack_ng_record(self, packet, sec, usec, caplen, wirelen, linktype, comment):
+        """DEV: returns an enhanced packet block, preceded by the description
+of its interface the first time its link type is met"""
+        if linktype is None:
+            linktype = self.linktype
+        ifid = self.interfaces.get(linktype)
+        idb = ""
+        if ifid is None:
+            ifid = self.interfaces[linktype] = len(self.interfaces)
+            if self.nano: # if_tsresol: 10^-9
+                idb = struct.pack(self.endian+"IIHHIHHBxxxII", 1, 32, linktype, 0, MTU,
+                                  9, 1, 9, 0, 32)
+            else:
+                idb = struct.pack(self.endian+"IIHHII", 1, 20, linktype, 0, MTU, 20)
+        opts = ""
+        if comment:
+            opts = struct.pack(self.endian+"HH", 1, len(comment))+comment+"\0"*(-len(comment)%4)
+            opts += "\0\0\0\0" # opt_endofopt
+        pad = "\0"*(-len(packet)%4)
+        blen = 32+len(packet)+len(pad)+len(opts)
+        ts = sec*(self.nano and 1000000000 or 1000000)+usec
+        return "".join((idb, struct.pack(self.endian+"IIIIIII", 6, blen, ifid, ts >> 32,
+                                         ts & 0xffffffffL, caplen, wirelen),
+                        packet, pad, opts, struct.pack(self.endian+"I", blen)))
 
     def flush(self):
         return self.f.flush()
 
     def close(self):
-        return self.f.close()
+        """closes the capture file, and waits for the previous files to be
+compressed (see compress_rotated)"""
+        self.f.close()
+        if self.rotated is not None:
+            while self.compressing:
+                self.compressing.popitem()[1].join()
 
     def __enter__(self):
         return self
@@ -755,12 +1795,194 @@ class PcapWriter(RawPcapWriter):
                 self.linktype = 1
         RawPcapWriter._write_header(self, pkt)
 
+    def write(self, pkt):
+        if isinstance(pkt, BasePacket) and pkt.is_unchanged():
+            # a dissected packet (from sniff(prn=...)): no need to iterate on it
+            if not self.header_present:
+                self._write_header(pkt)
+            self._write_packet(pkt)
+        else:
+            RawPcapWriter.write(self, pkt)
+
     def _write_packet(self, packet):
-        sec = int(packet.time)
-        usec = int(round((packet.time-sec)*1000000))
+        if self.rotated is not None and self.rotation_due():
+            self.rotate()
+        r = self._pack_packet(packet)
+        self.f.write(r)
+        self.nrecords += 1
+        self.nbytes += len(r)
+        if self.gz and self.sync:
+            self.f.flush()
+
+    def _pack_packet(self, packet):
+        if type(packet) is str: # already built (see Packet.iter_raw())
+            return self._pack_record(packet)
+        if self.nano:
+            sec,usec = divmod(get_time_ns(packet), 1000000000)
+        else:
+            sec = int(packet.time)
+            usec = int(round((packet.time-sec)*1000000))
         s = str(packet)
         caplen = len(s)
-        RawPcapWriter._write_packet(self, s, sec, usec, caplen, caplen)
+        if self.pcapng:
+            return self._pack_record(s, sec, usec, caplen, caplen,
+                                     conf.l2types.get(packet.__class__, self.linktype),
+                                     packet.comment)
+        return self._pack_record(s, sec, usec, caplen, caplen)
+
+
+#############################################
+## Capture files utilities on raw records ##
+#############################################
+
+def _ns_records(r, records=None):
+    """DEV: yields the records of a RawPcapReader (or the given ones, read
+from it by read_packet_ns()) as (time in ns, s, wirelen, linktype, comment)"""
+    if records is None:
+        records = iter(lambda: RawPcapReader.read_packet_ns(r), None)
+    for s,(sec,nsec,wirelen) in records:
+        yield (sec*1000000000+nsec, s, wirelen, r.linktype, r.comment)
+
+def _writer_args(readers, kargs):
+    """DEV: default RawPcapWriter arguments to write records of readers"""
+    # the resolution of the pcapng interfaces is only known when reading
+    kargs.setdefault("nano", bool([r for r in readers if r.nano or r.ng]))
+    if [r for r in readers if r.ng] or len(set(r.linktype for r in readers)) > 1:
+        kargs.setdefault("pcapng", True)
+    return kargs
+
+def _write_ns_records(w, records):
+    """DEV: writes records as yielded by _ns_records() with a RawPcapWriter"""
+    w.write_records_ns((s, divmod(t, 1000000000)+(wirelen,), linktype, comment)
+                       for t,s,wirelen,linktype,comment in records)
+
+@conf.commands.register
+def mergecap(outfile, infiles, **kargs):
+    """Merges capture files into outfile, in chronological order, without
+dissecting the packets. The output is a pcapng file when the link types of
+the inputs differ. Other arguments are passed to RawPcapWriter"""
+    readers = [RawPcapReader(f) for f in infiles]
+    w = RawPcapWriter(outfile, linktype=readers[0].linktype, **_writer_args(readers, kargs))
+    # the numbers of the input and of the record keep the merge stable
+    merged = heapq.merge(*[((rec[0],i,n)+rec[1:] for n,rec in enumerate(_ns_records(r)))
+                           for i,r in enumerate(readers)])
+    _write_ns_records(w, (rec[:1]+rec[3:] for rec in merged))
+    w.close()
+    for r in readers:
+        r.close()
+
+def flow_hash(s, linktype):
+    """Returns a hash of the addresses, protocol and ports of a raw frame,
+that is the same for both directions of a flow (0 if it is not IP)"""
+    off = 0
+    if linktype == 1: # Ethernet
+        off = 12
+        while s[off:off+2] in ("\x81\x00", "\x88\xa8"): # VLAN tags
+            off += 4
+        if s[off:off+2] not in ("\x08\x00", "\x86\xdd"):
+            return 0
+        off += 2
+    elif linktype == 113: # Linux cooked capture
+        off = 16
+    elif linktype == 0: # BSD loopback
+        off = 4
+    elif linktype not in (12, 14, 101): # raw IP
+        return 0
+    v = ord(s[off:off+1] or "\0") >> 4
+    if v == 4 and len(s) >= off+20:
+        proto = s[off+9]
+        a,b = s[off+12:off+16],s[off+16:off+20]
+        l4 = off+(ord(s[off]) & 15)*4
+        if ord(s[off+6]) & 0x3f or s[off+7] != "\0": # fragments: addresses only
+            l4 = None
+    elif v == 6 and len(s) >= off+40:
+        proto = s[off+6:off+7]
+        a,b = s[off+8:off+24],s[off+24:off+40]
+        l4 = off+40
+    else:
+        return 0
+    if l4 is not None and proto in ("\x06", "\x11", "\x84"): # TCP, UDP, SCTP
+        a += s[l4:l4+2]
+        b += s[l4+2:l4+4]
+    h = zlib.crc32(proto+min(a,b)+max(a,b)) & 0xffffffff
+    # crc32 is linear: mix its bits for the low ones to spread the flows
+    h = ((h ^ (h >> 16))*0x85ebca6b) & 0xffffffff
+    h = ((h ^ (h >> 13))*0xc2b2ae35) & 0xffffffff
+    return h ^ (h >> 16)
+
+@conf.commands.register
+def splitcap(infile, count=None, interval=None, flows=None, outfile=None, **kargs):
+    """Splits a capture file without dissecting the packets, and returns the
+names of the files written (<outfile>_00000.pcap, <outfile>_00001.pcap...)
+count: number of packets per file
+interval: number of seconds of capture per file
+flows: number of files the packets are spread into according to their
+       flow (addresses, protocol and ports, see flow_hash())
+outfile: base name of the output files (default: infile)
+Other arguments are passed to RawPcapWriter"""
+    r = RawPcapReader(infile)
+    _writer_args([r], kargs)
+    if outfile is None:
+        outfile = infile
+    if outfile.endswith(".gz"):
+        outfile = outfile[:-3]
+    root,ext = os.path.splitext(outfile)
+    names = []
+    def new_writer():
+        names.append("%s_%05i%s" % (root, len(names), ext))
+        w = RawPcapWriter(names[-1], linktype=r.linktype, **kargs)
+        w.write_records([]) # a valid capture, even with no packet
+        return w
+    if flows:
+        writers = [new_writer() for i in xrange(flows)]
+        batches = [[] for i in xrange(flows)]
+        for rec in _ns_records(r):
+            i = flow_hash(rec[1], rec[3]) % flows
+            b = batches[i]
+            b.append(rec)
+            if len(b) >= 1024:
+                _write_ns_records(writers[i], b)
+                del b[:]
+        for w,b in zip(writers, batches):
+            _write_ns_records(w, b)
+    elif count or interval:
+        iv = int((interval or 0)*1000000000)
+        state = {"file": -1, "n": 0, "end": None}
+        def file_number(rec):
+            """DEV: number of the output file of a record"""
+            t = rec[0]
+            if (state["file"] < 0 or (count and state["n"] >= count) or
+                (iv and t >= state["end"])):
+                state["file"] += 1
+                state["n"] = 0
+                if state["end"] is None:
+                    state["end"] = t+iv
+                elif iv and t >= state["end"]:
+                    state["end"] += ((t-state["end"])//iv+1)*iv
+            state["n"] += 1
+            return state["file"]
+        writers = []
+        for i,recs in itertools.groupby(_ns_records(r), file_number):
+            w = new_writer()
+            _write_ns_records(w, recs)
+            w.close()
+    else:
+        raise Scapy_Exception("splitcap() needs count, interval or flows")
+    for w in writers:
+        w.close()
+    r.close()
+    return names
+
+@conf.commands.register
+def slicecap(infile, outfile, t0, t1, **kargs):
+    """Writes the packets of a capture file captured from t0 (included) to
+t1 (excluded) into outfile, without dissecting them. Uses the index of the
+capture (see get_pcap_index()) to start reading close to t0"""
+    r = RawPcapReader(infile)
+    w = RawPcapWriter(outfile, linktype=r.linktype, **_writer_args([r], kargs))
+    _write_ns_records(w, _ns_records(r, r.records_between(t0, t1)))
+    w.close()
+    r.close()
 
 
 re_extract_hexcap = re.compile("^((0x)?[0-9a-fA-F]{2,}[ :\t]{,3}|) *(([0-9a-fA-F]{2} {,2}){,16})")